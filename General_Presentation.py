@@ -1,47 +1,15 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
 import altair as alt
-import json
-import numpy as np
 
-st.set_page_config(layout="wide")
+from dpe.dataset import get_backend
+from dpe.debug import debug_panel, start_page, track_chart
+from dpe.instrument import stage
+from dpe.reduction import chart_columns, downsample_lines, enable_server_transforms
+from dpe.sections import Sections
 
-@st.cache_data
-def load_data():
-    # Load the dataset
-    def concat_data():
-        """
-        Concatenate all the csv files to create a single dataframe.
-        """
-        dfs = []
-        for i in range(1, 9):
-            df = pd.read_csv(f"data/dpe-v2-logements-neufs-{i}.csv")
-            dfs.append(df)
-        return pd.concat(dfs, ignore_index=True)
-    dpe_data = concat_data()
-    # Convert date columns to datetime format
-    dpe_data["Date_établissement_DPE"] = pd.to_datetime(dpe_data["Date_établissement_DPE"], errors="coerce")
-    return dpe_data
-
-dpe_data = load_data()
-dpe_data.drop_duplicates(subset='Adresse_(BAN)', inplace=True)
-dpe_data.dropna(subset=['Date_établissement_DPE'], inplace=True)
-
-cart_adress = ['Adresse_(BAN)', 'Type_bâtiment',
-                'Surface_habitable_logement', 'Etiquette_GES',
-                'N°DPE', 'Etiquette_DPE', 'Modèle_DPE',
-                'Date_établissement_DPE']
-chart_conso = ["Conso_chauffage_é_finale", "Conso_éclairage_é_finale",
-                "Conso_ECS_é_finale",
-                "Conso_refroidissement_é_finale",
-                "Conso_auxiliaires_é_finale"]
-chart_cout = ["Coût_chauffage", "Coût_éclairage", "Coût_ECS",
-                "Coût_refroidissement"]
-
-dpe_data.drop_duplicates(subset='Adresse_(BAN)', inplace=True)
-dpe_data.dropna(subset=cart_adress + chart_conso + chart_cout, inplace=True)
+st.set_page_config(layout="wide")
+start_page("General_Presentation")
+enable_server_transforms()
 
 st.markdown("""
 # 🏠 Buildings for Tomorrow: Visualizing the Energy Performance of New Homes in France Since July 2021
@@ -63,131 +31,112 @@ urban development.
 
 st.subheader("Global Trends: are new buildings getting more efficient?")
 
-# Copy the data
-trend_data = dpe_data.copy()
-
-# Create a monthly period
-trend_data["month"] = trend_data["Date_établissement_DPE"].dt.to_period("M").dt.to_timestamp()
-
-# Define a helper function to compute weighted average, weighted variance, and standard error
-def weighted_stats(group):
-    # Weighted average of CO₂ emissions
-    w = group["Surface_habitable_logement"]
-    x = group["Emission_GES_5_usages_par_m²"]
-    weighted_mean = (x * w).sum() / w.sum()
-    # Weighted variance (using weights as given)
-    weighted_var = ((w * (x - weighted_mean)**2).sum()) / w.sum()
-    # Standard error: sqrt(variance)/sqrt(n)
-    n = len(group)
-    error = np.sqrt(weighted_var) / np.sqrt(n) if n > 0 else 0
-    return pd.Series({
-        "avg_co2": weighted_mean,
-        "building_count": n,
-        "error": error,
-        "lower": weighted_mean - error,
-        "upper": weighted_mean + error
-    })
-
-# Group by (month, building type) and compute weighted stats
-grouped_types = (
-    trend_data
-    .groupby(["month", "Type_bâtiment"], dropna=True)
-    .apply(weighted_stats)
-    .reset_index()
-)
-
-# Also compute overall monthly weighted stats
-grouped_overall = (
-    trend_data
-    .groupby("month", dropna=True)
-    .apply(weighted_stats)
-    .reset_index()
-)
-grouped_overall["Type_bâtiment"] = "Overall"
-
-# Combine the DataFrames
-combined_df = pd.concat([grouped_types, grouped_overall], ignore_index=True)
-
-# ---------------------------------------------------------------------------
-# MANUALLY REMOVE AN OUTLIER FOR A SPECIFIC MONTH & BUILDING TYPE
-# Example: Suppose the outlier is for "appartement" in November 2024,
-# and we'll set it to the December 2024 value for "appartement".
-# ---------------------------------------------------------------------------
-outlier_month = pd.Timestamp("2024-11-01")
-fix_month = pd.Timestamp("2024-12-01")
-
-mask_outlier = (
-    (combined_df["Type_bâtiment"] == "appartement") &
-    (combined_df["month"] == outlier_month)
-)
-mask_fix = (
-    (combined_df["Type_bâtiment"] == "appartement") &
-    (combined_df["month"] == fix_month)
-)
-
-if not combined_df[mask_fix].empty:
-    fix_value = combined_df.loc[mask_fix, "avg_co2"].values[0]
-    combined_df.loc[mask_outlier, "avg_co2"] = fix_value
-
-# ---------------------------------------------------------------------------
-# Filter out "immeuble" from the per-building-type data (but leave overall intact)
-# ---------------------------------------------------------------------------
-filtered_df = combined_df[
-    (combined_df["Type_bâtiment"] != "Overall") &
-    (combined_df["Type_bâtiment"] != "immeuble")
-]
-overall_df_before = combined_df[combined_df["Type_bâtiment"] == "Overall"]
-overall_df = overall_df_before[
-    overall_df_before["Type_bâtiment"].str.lower() != "immeuble"]
-
-# ---------------------------------------------------------------------------
-# CREATE THE ALTAR CHART
-# ---------------------------------------------------------------------------
-# Lines for each building type (filtered)
-lines_by_type = (
-    alt.Chart(filtered_df)
-    .mark_line(point=True)
-    .encode(
-        x=alt.X("month:T", title="Month"),
-        y=alt.Y("avg_co2:Q", title="Avg CO₂ (kg CO₂e/m²/yr)"),
-        color=alt.Color("Type_bâtiment:N", legend=alt.Legend(title="Building Type")),
-        tooltip=[
-            alt.Tooltip("month:T", title="Month"),
-            alt.Tooltip("Type_bâtiment:N", title="Building Type"),
-            alt.Tooltip("avg_co2:Q", title="Avg CO₂ (kg/m²/yr)", format=".2f"),
-            alt.Tooltip("building_count:Q", title="New Buildings Count")
-        ]
+# The trend chart is computed in the background (see dpe/sections.py)
+# while the text of the page is shown, loading the data on a first visit
+
+
+def trend_chart():
+    # Weighted monthly CO₂ statistics (weighted average, standard error and
+    # bounds) per building type and overall, computed once by the backend (see dpe/stats.py)
+    backend = get_backend()
+    with stage("monthly_trend") as record:
+        combined_df = backend.monthly_trend()
+        record["rows_out"] = len(combined_df)
+
+    # Anomalous months are flagged (and corrected, with DPE_TREND_CORRECTION)
+    # by the backend from a rolling median of each series (see dpe/stats.py)
+    anomalies_df = combined_df[combined_df["anomaly"] & (combined_df["Type_bâtiment"] != "immeuble")]
+
+    # ---------------------------------------------------------------------------
+    # Filter out "immeuble" from the per-building-type data (but leave overall intact)
+    # ---------------------------------------------------------------------------
+    filtered_df = combined_df[
+        (combined_df["Type_bâtiment"] != "Overall") &
+        (combined_df["Type_bâtiment"] != "immeuble")
+    ]
+    overall_df_before = combined_df[combined_df["Type_bâtiment"] == "Overall"]
+    overall_df = overall_df_before[
+        overall_df_before["Type_bâtiment"].str.lower() != "immeuble"]
+
+    # Only the encoded columns and a bounded number of points are embedded in
+    # the chart spec (see dpe/reduction.py)
+    trend_columns = ["month", "Type_bâtiment", "avg_co2", "building_count"]
+    filtered_df = downsample_lines(chart_columns(filtered_df, trend_columns), "month", "avg_co2",
+                                   by="Type_bâtiment", weight="building_count")
+    overall_df = downsample_lines(chart_columns(overall_df, trend_columns), "month", "avg_co2",
+                                  weight="building_count")
+
+    # ---------------------------------------------------------------------------
+    # CREATE THE ALTAR CHART
+    # ---------------------------------------------------------------------------
+    # Lines for each building type (filtered)
+    lines_by_type = (
+        alt.Chart(filtered_df)
+        .mark_line(point=True)
+        .encode(
+            x=alt.X("month:T", title="Month"),
+            y=alt.Y("avg_co2:Q", title="Avg CO₂ (kg CO₂e/m²/yr)"),
+            color=alt.Color("Type_bâtiment:N", legend=alt.Legend(title="Building Type")),
+            tooltip=[
+                alt.Tooltip("month:T", title="Month"),
+                alt.Tooltip("Type_bâtiment:N", title="Building Type"),
+                alt.Tooltip("avg_co2:Q", title="Avg CO₂ (kg/m²/yr)", format=".2f"),
+                alt.Tooltip("building_count:Q", title="New Buildings Count")
+            ]
+        )
     )
-)
-
-# Overall line
-overall_line = (
-    alt.Chart(overall_df)
-    .mark_line(point=True, color="black", strokeDash=[4, 2])
-    .encode(
-        x=alt.X("month:T", title="Month"),
-        y=alt.Y("avg_co2:Q", title="Avg CO₂ (kg CO₂e/m²/yr)"),
-        tooltip=[
-            alt.Tooltip("month:T", title="Month"),
-            alt.Tooltip("avg_co2:Q", title="Overall Avg CO₂ (kg/m²/yr)", format=".2f"),
-            alt.Tooltip("building_count:Q", title="New Buildings Count")
-        ]
+
+    # Overall line
+    overall_line = (
+        alt.Chart(overall_df)
+        .mark_line(point=True, color="black", strokeDash=[4, 2])
+        .encode(
+            x=alt.X("month:T", title="Month"),
+            y=alt.Y("avg_co2:Q", title="Avg CO₂ (kg CO₂e/m²/yr)"),
+            tooltip=[
+                alt.Tooltip("month:T", title="Month"),
+                alt.Tooltip("avg_co2:Q", title="Overall Avg CO₂ (kg/m²/yr)", format=".2f"),
+                alt.Tooltip("building_count:Q", title="New Buildings Count")
+            ]
+        )
     )
-)
 
 
 
 
-# Layer all charts together
-final_chart = alt.layer(
-    lines_by_type,
-    overall_line).resolve_scale(y='shared').encode(
-        x=alt.X("month:T", title="Month"),
-        y=alt.Y(title="Avg CO₂ (kg/m²/yr)", scale=alt.Scale(domain=[0,
-                                                                    15])),
+    # Flagged months, circled in red with the measured value
+    anomaly_points = (
+        alt.Chart(chart_columns(anomalies_df, ["month", "Type_bâtiment", "avg_co2", "avg_co2_raw"]))
+        .mark_point(color="red", size=150, filled=False, strokeWidth=2)
+        .encode(
+            x=alt.X("month:T", title="Month"),
+            y=alt.Y("avg_co2:Q", title="Avg CO₂ (kg CO₂e/m²/yr)"),
+            tooltip=[
+                alt.Tooltip("month:T", title="Month"),
+                alt.Tooltip("Type_bâtiment:N", title="Building Type"),
+                alt.Tooltip("avg_co2_raw:Q", title="Measured Avg CO₂ (kg/m²/yr)", format=".2f"),
+                alt.Tooltip("avg_co2:Q", title="Shown Avg CO₂ (kg/m²/yr)", format=".2f"),
+            ]
+        )
     )
 
-st.altair_chart(final_chart, use_container_width=True)
+    # Layer all charts together
+    return alt.layer(
+        lines_by_type,
+        overall_line,
+        anomaly_points).resolve_scale(y='shared').encode(
+            x=alt.X("month:T", title="Month"),
+            y=alt.Y(title="Avg CO₂ (kg/m²/yr)", scale=alt.Scale(domain=[0,
+                                                                        15])),
+        )
+
+
+def show_trend(chart):
+    st.altair_chart(track_chart("trend", chart), use_container_width=True)
+
+
+sections = Sections()
+sections.add("trend", trend_chart, show_trend, "Loading the trend chart...")
 
 st.markdown("""
 This chart shows the average CO₂ emissions (kg CO₂-eq/m²/yr) for two 
@@ -216,7 +165,10 @@ advancements, or other factors might be influencing the carbon footprint of
 new buildings over time.
 
 Note that we removed the "immeuble" type from the analysis, as their
-data is noisy. We also manually fixed an outlier for the "appartement" 
-type in November 2024 by replacing it with the December 2024 value.""")
+data is noisy. Months far from the median of the surrounding months of
+their series are detected automatically and, by default, replaced by that
+median; they are circled in red, with the measured value in the tooltip.""")
 
+sections.render()
 
+debug_panel()
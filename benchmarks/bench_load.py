@@ -0,0 +1,59 @@
+"""
+Compare the original sequential csv loading with the parallel shard reader.
+
+    python -m benchmarks.bench_load --data-dir data --repeat 3
+"""
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from dpe.config import DATA_DIR
+from dpe.store import read_shards, shard_paths
+
+
+def load_sequential(paths):
+    """
+    Loading path of the app before the store: every column of every shard,
+    one shard after the other, then a concat and a date conversion.
+    """
+    dfs = []
+    for path in paths:
+        dfs.append(pd.read_csv(path))
+    dpe_data = pd.concat(dfs, ignore_index=True)
+    dpe_data["Date_établissement_DPE"] = pd.to_datetime(dpe_data["Date_établissement_DPE"], errors="coerce")
+    return dpe_data
+
+
+def best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--workers", default=None, type=int)
+    args = parser.parse_args()
+
+    paths = shard_paths(args.data_dir)
+    if not paths:
+        raise SystemExit(f"No shard found in {args.data_dir}")
+
+    sequential, df_seq = best_time(lambda: load_sequential(paths), args.repeat)
+    parallel, df_par = best_time(lambda: read_shards(paths, args.workers), args.repeat)
+
+    print(f"{len(paths)} shards, {len(df_par)} rows")
+    print(f"sequential : {sequential:8.3f} s  {df_seq.memory_usage(deep=True).sum() / 1e6:9.1f} MB")
+    print(f"parallel   : {parallel:8.3f} s  {df_par.memory_usage(deep=True).sum() / 1e6:9.1f} MB")
+    print(f"speedup    : {sequential / parallel:8.2f} x")
+
+
+if __name__ == "__main__":
+    main()
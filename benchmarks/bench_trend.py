@@ -0,0 +1,76 @@
+"""
+Compare the groupby().apply(weighted_stats) trend with the vectorized engine.
+
+    python -m benchmarks.bench_trend --data-dir data --repeat 3
+"""
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from dpe.cleaning import clean, complete
+from dpe.config import DATA_DIR
+from dpe.stats import TYPE, monthly_trend, weighted_stats
+from dpe.store import read_shards, shard_paths
+
+
+def trend_apply(dpe_data):
+    """
+    Trend computation of the landing page before the vectorized engine.
+    """
+    trend_data = dpe_data.assign(
+        month=dpe_data["Date_établissement_DPE"].dt.to_period("M").dt.to_timestamp()
+    )
+    grouped_types = (
+        trend_data
+        .groupby(["month", TYPE], dropna=True, observed=True)
+        .apply(weighted_stats)
+        .reset_index()
+    )
+    grouped_overall = (
+        trend_data
+        .groupby("month", dropna=True)
+        .apply(weighted_stats)
+        .reset_index()
+    )
+    grouped_overall[TYPE] = "Overall"
+    return pd.concat([grouped_types, grouped_overall], ignore_index=True)
+
+
+def best_time(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def check_same(reference, result):
+    keys = ["month", TYPE]
+    reference = reference.astype({TYPE: object}).sort_values(keys).reset_index(drop=True)
+    result = result.sort_values(keys).reset_index(drop=True)
+    pd.testing.assert_frame_equal(reference, result[reference.columns], check_dtype=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--repeat", default=3, type=int)
+    args = parser.parse_args()
+
+    dpe_data = complete(clean(read_shards(shard_paths(args.data_dir))))
+
+    apply_time, reference = best_time(lambda: trend_apply(dpe_data), args.repeat)
+    vector_time, result = best_time(lambda: monthly_trend(dpe_data), args.repeat)
+    check_same(reference, result)
+
+    print(f"{len(dpe_data)} rows, {len(result)} groups, results identical")
+    print(f"groupby.apply : {apply_time:8.4f} s")
+    print(f"vectorized    : {vector_time:8.4f} s")
+    print(f"speedup       : {apply_time / vector_time:8.2f} x")
+
+
+if __name__ == "__main__":
+    main()
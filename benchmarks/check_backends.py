@@ -0,0 +1,143 @@
+"""
+Check that a backend gives the same results as the pandas backend.
+
+    python -m benchmarks.synthetic --rows 30000 --out data/synthetic
+    python -m benchmarks.check_backends --data-dir data/synthetic --backend duckdb
+    python -m dpe.precompute --data-dir data/synthetic --store-dir data/synthetic/store
+    python -m benchmarks.check_backends --data-dir data/synthetic --backend artifacts
+
+The repository has no test suite: this script is the test of the
+backends. It exits with an AssertionError on the first difference; run it
+for each backend after changing one of them. The synthetic shards have
+repeated addresses and missing départements, which the real data may not.
+"""
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from dpe.address_index import normalize, street_key
+from dpe.backends import create_backend
+from dpe.config import DATA_DIR, STORE_DIR
+
+
+# Queries of the address search: prefixes of addresses and streets, and
+# strings close to none of them
+SEARCHES = ["1 rue", "rue", "12 ru", "avenue", "zzqxw", "qwertyuiop asdf"]
+
+
+def _is_prefix_match(query, address):
+    key, address = normalize(query), normalize(address)
+    return address.startswith(key) or street_key(address).startswith(key)
+
+
+def _objects(frame):
+    # Values of a frame as objects, missing ones as None whatever the backend
+    return frame.astype(object).where(frame.notna(), None)
+
+
+def compare_frames(left, right, keys):
+    left = left.sort_values(keys).reset_index(drop=True)
+    right = right.sort_values(keys).reset_index(drop=True)[left.columns]
+    pd.testing.assert_frame_equal(left, right, check_dtype=False, check_index_type=False)
+
+
+def check(reference, backend):
+    """
+    Run every query of the pages on both backends, raise on a difference.
+    """
+    options = reference.filter_options()
+    assert options == backend.filter_options(), "filter options differ"
+
+    compare_frames(reference.monthly_trend(), backend.monthly_trend(), ["month", "Type_bâtiment"])
+
+    pd.testing.assert_frame_equal(reference.label_table(), backend.label_table(),
+                                  check_dtype=False, check_index_type=False)
+
+    # A few départements and the missing one, when some rows have none, as
+    # can be chosen on the drill-down page
+    departements = reference.label_table().index[:3].tolist()
+    missing = [departement for departement in reference.label_table().index if pd.isna(departement)]
+
+    timeline, other = reference.label_timeline(), backend.label_timeline()
+    assert timeline.month_range() == other.month_range(), "label months differ"
+    first, last = timeline.month_range()
+    middle = first + (last - first) / 2
+    for window in [(None, None), (first, middle), (middle, last), (middle, middle)]:
+        pd.testing.assert_frame_equal(timeline.average(*window), other.average(*window))
+        for departement in [None] + departements + missing:
+            pd.testing.assert_frame_equal(timeline.counts(*window, departement),
+                                          other.counts(*window, departement))
+
+    peer_group = ["Type_bâtiment", "Etiquette_GES", "Etiquette_DPE"]
+    compare_frames(reference._peer_group_means.reset_index().astype({key: object for key in peer_group}),
+                   backend._peer_group_means.reset_index().astype({key: object for key in peer_group}),
+                   peer_group)
+
+    years = (options["min_year"], options["max_year"])
+    filter_states = [
+        (years, options["building_types"], options["categories"]),
+        ((years[0], years[0]), options["building_types"][:1], options["categories"][:3]),
+        ((years[1], years[1]), options["building_types"][1:], options["categories"][-3:]),
+    ]
+    for year_range, building_types, categories in filter_states:
+        compare_frames(reference.departement_summary(year_range, building_types, categories),
+                       backend.departement_summary(year_range, building_types, categories),
+                       ["departement"])
+        compare_frames(reference.inefficient_breakdown(year_range, building_types),
+                       backend.inefficient_breakdown(year_range, building_types),
+                       ["N°_département_(BAN)", "Etiquette_DPE"])
+
+    pages = [
+        dict(),
+        dict(departements=departements, page=2, page_size=20),
+        dict(departements=departements + missing, page=1, page_size=200),
+        dict(departements=missing or departements[:1], sort_by="Date_établissement_DPE"),
+        dict(sort_by="Emission_GES_5_usages_par_m²", ascending=False, columns=["Adresse_(BAN)", "N°DPE"]),
+        dict(sort_by="Type_bâtiment", departements=departements, page=1),
+    ]
+    for year_range, building_types, categories in filter_states:
+        for options in pages:
+            expected, expected_total = reference.rows_page(year_range, building_types, categories, **options)
+            got, total = backend.rows_page(year_range, building_types, categories, **options)
+            assert expected_total == total, f"rows_page {options}: {total} rows instead of {expected_total}"
+            pd.testing.assert_frame_equal(_objects(expected), _objects(got[expected.columns]), check_dtype=False)
+
+    addresses = reference.search_addresses("", limit=20)
+    for query in SEARCHES + addresses[:3]:
+        expected, got = reference.search_addresses(query), backend.search_addresses(query)
+        # Prefix matches come first and agree (up to the order of equal
+        # keys); close spellings are ranked by different similarities, but
+        # with the same cutoff nonsense finds nothing on both backends
+        prefix = [address for address in expected if _is_prefix_match(query, address)]
+        got_prefix = [address for address in got if _is_prefix_match(query, address)]
+        assert expected[:len(prefix)] == prefix and got[:len(got_prefix)] == got_prefix, \
+            f"search {query!r} ranks a close spelling before a prefix match"
+        assert len(prefix) == len(got_prefix), f"search {query!r} differs"
+        if len(prefix) < 50:
+            assert set(prefix) == set(got_prefix), f"search {query!r} differs"
+        assert len(expected) == len(set(expected)) and len(got) == len(set(got)), f"search {query!r} repeats"
+        assert bool(expected) == bool(got), f"search {query!r} differs"
+        if query in addresses:
+            assert expected[0] == got[0] == query, f"search {query!r} misses the address"
+
+    for address in addresses:
+        expected = reference.address_row(address).reset_index(drop=True)
+        got = backend.address_row(address).reset_index(drop=True)
+        pd.testing.assert_frame_equal(_objects(expected), _objects(got[expected.columns]), check_dtype=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--store-dir", default=None, type=Path)
+    parser.add_argument("--backend", default="duckdb", choices=["duckdb", "artifacts"])
+    args = parser.parse_args()
+    store_dir = args.store_dir or (args.data_dir / "store" if args.data_dir != DATA_DIR else STORE_DIR)
+
+    check(create_backend("pandas", args.data_dir, store_dir), create_backend(args.backend, args.data_dir, store_dir))
+    print(f"pandas and {args.backend} backends agree")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Simulate many users of the dashboard at once, headless, with Streamlit's AppTest.
+
+    DPE_DATA_DIR=data python -m benchmarks.load_test --sessions 1 8 32 --steps 10
+
+Every simulated session plays a random sequence of interactions: on the
+Geographical overview it moves the year slider and changes the building
+type and DPE category multiselects, on the Breakdown page it picks a
+département, searches addresses and picks one of them. Each interaction is
+a rerun of the page script, timed from the widget change to the end of the
+run. The sessions run in threads of this process, sharing its
+``st.cache_resource`` objects as the sessions of one Streamlit server do.
+
+For each number of sessions the harness reports the p50/p95 rerun latency
+(per page and overall), the reruns per second, the peak resident memory
+over the run and its growth per session, and the number of copies of the
+cached objects built (misses of ``dpe.instrument.counted_cache``), which
+should not grow with the number of sessions. The settings of the app
+(DPE_BACKEND, DPE_DATA_DIR...) are read from the environment as usual.
+"""
+import argparse
+import json
+import random
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from streamlit.testing.v1 import AppTest
+
+from benchmarks.suite import RSSPeak
+from dpe.instrument import cache_stats, resident_memory
+
+ROOT = Path(__file__).resolve().parents[1]
+GEO_PAGE = "pages/Geographical_overview.py"
+BREAKDOWN_PAGE = "pages/Breakown_per_Departement_and_Adress.py"
+
+# Queries typed in the address search
+SEARCHES = ["1 rue", "rue 12", "avenue", "10 ", "ville", "chemin 3"]
+
+
+def _widget(widgets, label):
+    return next(widget for widget in widgets if widget.label == label)
+
+
+def _subset(options, rng):
+    # Non-empty random subset, in the order of the options
+    chosen = [option for option in options if rng.random() < 0.5]
+    return chosen or [rng.choice(options)]
+
+
+def geo_interactions(at, rng):
+    """
+    Random change of the filters of the Geographical overview.
+    """
+    action = rng.choice(["years", "building_types", "categories"])
+    if action == "years":
+        slider = at.slider(key="filter_years")
+        years = range(int(slider.min), int(slider.max) + 1)
+        first, last = sorted(rng.choice(years) for _ in range(2))
+        slider.set_range(first, last)
+    elif action == "building_types":
+        multiselect = at.multiselect(key="filter_building_types")
+        multiselect.set_value(_subset(multiselect.options, rng))
+    else:
+        multiselect = at.multiselect(key="filter_categories")
+        multiselect.set_value(_subset(multiselect.options, rng))
+    return action
+
+
+def breakdown_interactions(at, rng):
+    """
+    Random département, address search or address pick on the Breakdown page.
+    """
+    actions = ["departement", "search"]
+    if any(widget.label == "Choose an Adress" for widget in at.selectbox):
+        actions.append("address")
+    action = rng.choice(actions)
+    if action == "departement":
+        selectbox = _widget(at.selectbox, "Choose a Departement")
+        selectbox.select(rng.choice(selectbox.options))
+    elif action == "search":
+        at.text_input[0].input(rng.choice(SEARCHES))
+    else:
+        selectbox = _widget(at.selectbox, "Choose an Adress")
+        selectbox.select(rng.choice(selectbox.options))
+    return action
+
+
+PAGES = {GEO_PAGE: geo_interactions, BREAKDOWN_PAGE: breakdown_interactions}
+
+
+def run_session(seed, steps, timeout):
+    """
+    Play ``steps`` interactions on every page in one session and return
+    the timings of the reruns as (page, action, seconds).
+    """
+    rng = random.Random(seed)
+    timings = []
+    for page, interact in PAGES.items():
+        at = AppTest.from_file(str(ROOT / page), default_timeout=timeout)
+        start = time.perf_counter()
+        at.run()
+        timings.append((page, "load", time.perf_counter() - start))
+        for _ in range(steps):
+            action = interact(at, rng)
+            start = time.perf_counter()
+            at.run()
+            timings.append((page, action, time.perf_counter() - start))
+            if at.exception:
+                raise RuntimeError(f"{page} ({action}): {at.exception[0].message}")
+    return timings
+
+
+def percentiles(seconds):
+    return {"p50": round(float(np.percentile(seconds, 50)), 4), "p95": round(float(np.percentile(seconds, 95)), 4)}
+
+
+def load_test(sessions, steps, seed=0, timeout=300):
+    """
+    Run ``sessions`` simulated sessions in parallel and return their measures.
+    """
+    misses_before = {name: stats["misses"] for name, stats in cache_stats().items()}
+    rss_before = resident_memory()
+    start = time.perf_counter()
+    with RSSPeak() as resident:
+        with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="dpe-load") as pool:
+            results = list(pool.map(lambda i: run_session(seed + i, steps, timeout), range(sessions)))
+    elapsed = time.perf_counter() - start
+    timings = [timing for result in results for timing in result]
+    reruns = [seconds for _, action, seconds in timings if action != "load"]
+    copies = {
+        name: stats["misses"] - misses_before.get(name, 0)
+        for name, stats in cache_stats().items()
+    }
+    return {
+        "sessions": sessions,
+        "reruns": len(reruns),
+        "reruns_per_second": round(len(reruns) / elapsed, 2),
+        "rerun_latency": percentiles(reruns),
+        "load_latency": percentiles([seconds for _, action, seconds in timings if action == "load"]),
+        "pages": {
+            page: percentiles([seconds for name, action, seconds in timings if name == page and action != "load"])
+            for page in PAGES
+        },
+        "rss_mb": None if rss_before is None else round(rss_before + resident.growth, 1),
+        "rss_per_session_mb": None if resident.growth is None else round(resident.growth / sessions, 2),
+        "cached_copies": copies,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", default=[1, 8], type=int, nargs="+", help="numbers of parallel sessions to run")
+    parser.add_argument("--steps", default=10, type=int, help="interactions per page and session")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--timeout", default=300, type=float, help="seconds allowed for one rerun")
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    # A first session builds the cached objects, so that the runs below
+    # measure the steady state; its copies are the ones every run shares
+    print("warm-up: 1 session", flush=True)
+    warmup = load_test(1, 1, args.seed, args.timeout)
+    print(f"  cached objects built: {warmup['cached_copies']}", flush=True)
+
+    results = []
+    for sessions in args.sessions:
+        result = load_test(sessions, args.steps, args.seed, args.timeout)
+        results.append(result)
+        latency = result["rerun_latency"]
+        print(f"{sessions} sessions: {result['reruns']} reruns, {result['reruns_per_second']} per second, "
+              f"p50 {latency['p50']:.3f} s, p95 {latency['p95']:.3f} s", flush=True)
+        for page, page_latency in result["pages"].items():
+            print(f"  {page:<48} p50 {page_latency['p50']:.3f} s, p95 {page_latency['p95']:.3f} s")
+        if result["rss_mb"] is not None:
+            print(f"  peak resident memory {result['rss_mb']:.1f} MB, "
+                  f"{result['rss_per_session_mb']:.2f} MB per session")
+        copies = {name: count for name, count in result["cached_copies"].items() if count}
+        print(f"  cached objects copied: {copies or 'none'}", flush=True)
+
+    # Peak of the whole process, including the warm-up (kB on Linux)
+    print(f"max resident memory of the process: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / 1e6:.1f} MB")
+    if args.json:
+        args.json.write_text(json.dumps({"warmup": warmup, "runs": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
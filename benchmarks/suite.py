@@ -0,0 +1,223 @@
+"""
+Time the data paths of the app on synthetic datasets and compare with a baseline.
+
+    python -m benchmarks.suite --rows 100000 1000000
+    python -m benchmarks.suite --rows 100000 --save-baseline
+
+Every stage is timed (best of ``--repeat`` runs) and then run once more
+for its memory: the peak of Python and numpy allocations seen by
+tracemalloc, and the peak growth of the resident memory (which also
+counts the arrow buffers, sampled from /proc on Linux). A stage slower or
+larger than the baseline of the same scale by more than ``--tolerance``
+is reported as a regression and the exit status is 1. Baselines depend on
+the machine: save them on the one running the comparison.
+"""
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.synthetic import generate
+from dpe.address_index import AddressIndex
+from dpe.cleaning import clean, complete
+from dpe.compaction import compact
+from dpe.cubes import (
+    departement_cube,
+    departement_summary,
+    inefficient_breakdown,
+    label_cube,
+    label_table,
+    peer_group_means,
+    peer_means,
+)
+from dpe.instrument import resident_memory
+from dpe.label_timeline import LabelTimeline
+from dpe.stats import monthly_trend
+from dpe.store import build_store, load_store, read_shards, shard_paths
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+# Differences under which a measure is noise, whatever the tolerance
+MIN_DELTAS = {"seconds": 0.2, "peak_mb": 5.0, "rss_mb": 20.0}
+
+# Queries of the address search
+SEARCHES = ["1 rue", "12 rue 3", "rue 42", "250 rue 1000 ville", "ru 7 vile"]
+
+
+class RSSPeak:
+    """
+    Peak growth of the resident memory while in the block, sampled every
+    ``interval`` seconds (``growth`` stays None where it is not available).
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.growth = None
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self._peak = max(self._peak, resident_memory())
+
+    def __enter__(self):
+        self._start = resident_memory()
+        if self._start is not None:
+            self._peak = self._start
+            self._done = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            self._done.set()
+            self._thread.join()
+            self.growth = max(self._peak, resident_memory()) - self._start
+
+
+def measure(func, repeat, memory=True):
+    """
+    Best wall time of ``func`` over ``repeat`` runs, peaks of allocated
+    and resident memory of one run (MB, None if not measured) and its
+    result.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    peak = rss = None
+    if memory:
+        del result
+        with RSSPeak() as resident:
+            tracemalloc.start()
+            result = func()
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        rss = resident.growth
+    return min(timings), peak, rss, result
+
+
+def run_suite(data_dir, store_dir, repeat=3, memory=True):
+    """
+    Run the stages on the shards of ``data_dir`` and return their
+    measures, by stage name.
+    """
+    results = {}
+
+    def stage(name, func):
+        seconds, peak, rss, result = measure(func, repeat, memory)
+        results[name] = {
+            "seconds": round(seconds, 4),
+            "peak_mb": None if peak is None else round(peak, 1),
+            "rss_mb": None if rss is None else round(rss, 1),
+        }
+        line = f"  {name:<24} {seconds:9.3f} s"
+        if peak is not None:
+            line += f"  {peak:9.1f} MB allocated"
+        if rss is not None:
+            line += f"  {rss:9.1f} MB resident"
+        print(line, flush=True)
+        return result
+
+    paths = shard_paths(data_dir)
+    stage("load_csv", lambda: read_shards(paths))
+    stage("build_store", lambda: build_store(data_dir, store_dir, force=True))
+    raw = stage("load_store", lambda: load_store(data_dir=data_dir, store_dir=store_dir))
+    dpe_data = stage("clean", lambda raw=raw: compact(clean(raw))[0])
+    del raw
+
+    stage("trend", lambda: monthly_trend(complete(dpe_data)))
+    cube = stage("departement_cube", lambda: departement_cube(dpe_data))
+    years = (int(cube["year"].min()), int(cube["year"].max()))
+    types = sorted(dpe_data["Type_bâtiment"].dropna().unique())
+    filter_states = [(years, types, ["E", "F", "G"]), ((years[0], years[0]), types[:1], ["A", "B"])]
+    stage("departement_summary",
+          lambda: [departement_summary(cube, *state) for state in filter_states])
+    stage("inefficient_breakdown",
+          lambda: [inefficient_breakdown(cube, year_range, building_types) for year_range, building_types, _ in filter_states])
+
+    def label_charts():
+        cube = label_cube(dpe_data)
+        table = label_table(cube)
+        timeline = LabelTimeline(cube)
+        first, last = timeline.month_range()
+        timeline.average(first, last)
+        return [timeline.counts(first, last, departement) for departement in table.index]
+    stage("label_counts", label_charts)
+
+    index = stage("address_index", lambda: AddressIndex(dpe_data["Adresse_(BAN)"]))
+    means = peer_group_means(dpe_data)
+
+    def address_queries():
+        for query in SEARCHES:
+            for address in index.search(query, limit=50)[:5]:
+                row = dpe_data.iloc[[index.locate(address)]]
+                peer_means(means, row["Type_bâtiment"].iloc[0], row["Etiquette_GES"].iloc[0],
+                           row["Etiquette_DPE"].iloc[0])
+    stage("address_queries", address_queries)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Regressions of ``results`` against ``baseline``, as messages.
+    """
+    regressions = []
+    for name, measures in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for key, unit in (("seconds", "s"), ("peak_mb", "MB"), ("rss_mb", "MB resident")):
+            if measures.get(key) is None or reference.get(key) is None:
+                continue
+            if measures[key] > reference[key] * (1 + tolerance) and measures[key] - reference[key] > MIN_DELTAS[key]:
+                regressions.append(f"{name}: {measures[key]} {unit} against {reference[key]} {unit}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", default=[100_000], type=int, nargs="+", help="scales to run, e.g. 100000 1000000")
+    parser.add_argument("--work-dir", default=Path(tempfile.gettempdir()) / "dpe-bench", type=Path,
+                        help="where the synthetic shards and their store are written")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--baseline", default=BASELINE_PATH, type=Path)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", default=0.5, type=float, help="relative growth accepted")
+    args = parser.parse_args()
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    regressions = []
+    for rows in args.rows:
+        data_dir = args.work_dir / str(rows)
+        print(f"{rows} rows: generating shards in {data_dir}", flush=True)
+        generate(rows, data_dir)
+        results = run_suite(data_dir, data_dir / "store", args.repeat, not args.no_memory)
+        if args.save_baseline:
+            baseline[str(rows)] = results
+        else:
+            regressions += [f"{rows} rows, {message}" for message in
+                            compare(results, baseline.get(str(rows), {}), args.tolerance)]
+    # ru_maxrss is in kB on Linux
+    print(f"peak resident memory of the run: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3:.0f} MB")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"baseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"no baseline in {args.baseline}, save one with --save-baseline")
+    elif regressions:
+        print("regressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    else:
+        print("no regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
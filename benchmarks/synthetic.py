@@ -0,0 +1,123 @@
+"""
+Generate a synthetic DPE dataset with the columns of the ADEME shards.
+
+    python -m benchmarks.synthetic --rows 1000000 --out data/synthetic-1m
+
+The shards are written chunk by chunk, so datasets larger than memory can
+be generated. The values follow rough distributions of the real data:
+repeated addresses (several DPE per building), missing values (départements
+included), a few invalid dates and emission outliers.
+"""
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Columns of the dpe-v2-logements-neufs shards, in file order
+CSV_COLUMNS = [
+    "N°DPE", "Date_établissement_DPE", "Modèle_DPE", "Adresse_(BAN)", "N°_département_(BAN)",
+    "Nom_commune_(BAN)", "Type_bâtiment", "Surface_habitable_logement", "Etiquette_DPE", "Etiquette_GES",
+    "Emission_GES_5_usages_par_m²", "Conso_chauffage_é_finale", "Conso_éclairage_é_finale",
+    "Conso_ECS_é_finale", "Conso_refroidissement_é_finale", "Conso_auxiliaires_é_finale",
+    "Coût_chauffage", "Coût_éclairage", "Coût_ECS", "Coût_refroidissement", "Coût_total_5_usages",
+]
+
+LABELS = np.array(list("ABCDEFG"))
+DPE_SHARES = [0.30, 0.30, 0.20, 0.10, 0.05, 0.03, 0.02]
+GES_SHARES = [0.50, 0.20, 0.10, 0.10, 0.05, 0.03, 0.02]
+DEPARTEMENTS = np.array([f"{i:02d}" for i in range(1, 96) if i != 20] + ["2A", "2B"] + [str(i) for i in range(971, 977)])
+BUILDING_TYPES = np.array(["appartement", "maison", "immeuble"])
+MODELS = np.array(["DPE 3CL 2021 méthode logement", "DPE NEUF logement : RT2012", "DPE NEUF logement : RE2020"])
+CONSO = ["Conso_chauffage_é_finale", "Conso_éclairage_é_finale", "Conso_ECS_é_finale",
+         "Conso_refroidissement_é_finale", "Conso_auxiliaires_é_finale"]
+COUT = ["Coût_chauffage", "Coût_éclairage", "Coût_ECS", "Coût_refroidissement", "Coût_total_5_usages"]
+
+FIRST_DATE = np.datetime64("2021-07-01")
+DAYS = 1200
+
+# Distinct addresses per row, the rest are further DPE of the same building
+ADDRESS_RATIO = 0.8
+
+CHUNK_ROWS = 500_000
+MANIFEST_NAME = ".synthetic.json"
+# Bumped when the generated values change, so that older datasets are rebuilt
+VERSION = 2
+
+
+def generate_chunk(rng, start, rows, addresses, shard):
+    """
+    Frame of ``rows`` synthetic DPE numbered from ``start``.
+    """
+    dates = np.datetime_as_string(FIRST_DATE + rng.integers(0, DAYS, rows).astype("timedelta64[D]"), unit="D")
+    dates = dates.astype(object)
+    dates[rng.random(rows) < 0.002] = "not a date"
+    address_ids = rng.integers(0, addresses, rows)
+    address = pd.Series(address_ids % 300 + 1).astype(str) + " rue " + pd.Series(address_ids // 300).astype(str) + " Ville"
+    address[rng.random(rows) < 0.005] = np.nan
+    departements = rng.choice(DEPARTEMENTS, rows).astype(object)
+    departements[rng.random(rows) < 0.002] = np.nan
+    ghg = rng.gamma(2, 3, rows).round(1)
+    outliers = rng.random(rows) < 0.0005
+    ghg[outliers] *= 100
+    chunk = {
+        "N°DPE": pd.Series(np.arange(start, start + rows) + shard * 10**10).astype(str),
+        "Date_établissement_DPE": dates,
+        "Modèle_DPE": rng.choice(MODELS, rows),
+        "Adresse_(BAN)": address,
+        "N°_département_(BAN)": departements,
+        "Nom_commune_(BAN)": "Ville",
+        "Type_bâtiment": rng.choice(BUILDING_TYPES, rows, p=[0.5, 0.45, 0.05]),
+        "Surface_habitable_logement": rng.uniform(15, 200, rows).round(1),
+        "Etiquette_DPE": rng.choice(LABELS, rows, p=DPE_SHARES),
+        "Etiquette_GES": rng.choice(LABELS, rows, p=GES_SHARES),
+        "Emission_GES_5_usages_par_m²": ghg,
+    }
+    for col in CONSO:
+        chunk[col] = rng.gamma(2, 1000, rows).round(1)
+    for col in COUT:
+        chunk[col] = rng.gamma(2, 100, rows).round(1)
+    frame = pd.DataFrame(chunk, columns=CSV_COLUMNS)
+    frame.loc[rng.random(rows) < 0.02, "Conso_refroidissement_é_finale"] = np.nan
+    frame.loc[rng.random(rows) < 0.01, "Surface_habitable_logement"] = np.nan
+    return frame
+
+
+def generate(rows, out_dir, shards=8, seed=0, chunk_rows=CHUNK_ROWS):
+    """
+    Write ``rows`` synthetic DPE as ``shards`` csv shards in ``out_dir``,
+    unless the same dataset is already there. Return the shard paths.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    params = {"rows": rows, "shards": shards, "seed": seed, "version": VERSION}
+    manifest = out_dir / MANIFEST_NAME
+    paths = [out_dir / f"dpe-v2-logements-neufs-{shard}.csv" for shard in range(1, shards + 1)]
+    if manifest.exists() and json.loads(manifest.read_text()) == params and all(path.exists() for path in paths):
+        return paths
+    rng = np.random.default_rng(seed)
+    addresses = max(int(rows * ADDRESS_RATIO), 1)
+    for shard, path in enumerate(paths, start=1):
+        shard_rows = rows // shards + (shard <= rows % shards)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for start in range(0, shard_rows, chunk_rows):
+                chunk = generate_chunk(rng, start, min(chunk_rows, shard_rows - start), addresses, shard)
+                chunk.to_csv(f, index=False, header=start == 0)
+    manifest.write_text(json.dumps(params))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", default=100_000, type=int)
+    parser.add_argument("--out", required=True, type=Path)
+    parser.add_argument("--shards", default=8, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+    paths = generate(args.rows, args.out, args.shards, args.seed)
+    print(f"{args.rows} rows in {len(paths)} shards in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+Data layer of the EDA New Buildings app: ingestion of the ADEME
+dpe-v2-logements-neufs shards and the helpers shared by the pages.
+"""
@@ -0,0 +1,129 @@
+"""
+Search index over the addresses of the dataset.
+
+Addresses are normalized (lower case, no accents nor punctuation) and kept
+in sorted arrays, so that prefix searches and exact lookups are binary
+searches instead of scans of the rows. A second sorted array holds the
+addresses without their house number, to find a street typed without it.
+"""
+import difflib
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+ADDRESS = "Adresse_(BAN)"
+
+# Highest code point, closes the range of keys starting with a prefix
+_END = "\U0010ffff"
+_HOUSE_NUMBER = re.compile(r"^\d+\s*(bis|ter|quater|[a-z])?\s+")
+
+# Least similarity (0 to 1) of a close spelling
+FUZZY_CUTOFF = 0.6
+
+
+def normalize(text):
+    """
+    Search key of an address: lower case, without accents, punctuation or
+    repeated spaces.
+    """
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    text = text.encode("ascii", errors="ignore").decode("ascii")
+    return " ".join(re.sub(r"[^\w]+", " ", text).split())
+
+
+def street_key(key):
+    """
+    Search key of an address without its house number.
+    """
+    return _HOUSE_NUMBER.sub("", key)
+
+
+def _normalize_series(addresses):
+    keys = (
+        addresses.str.lower()
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+        .str.replace(r"[^\w]+", " ", regex=True)
+        .str.split()
+        .str.join(" ")
+    )
+    return keys.to_numpy(dtype=object)
+
+
+def _sorted(keys):
+    order = np.argsort(keys, kind="stable")
+    return keys[order], order
+
+
+class AddressIndex:
+    """
+    Index of the addresses of ``dpe_data`` pointing to their row position.
+    """
+
+    def __init__(self, addresses):
+        addresses = pd.Series(addresses).reset_index(drop=True).astype("string")
+        known = addresses.notna().to_numpy()
+        positions = np.flatnonzero(known)
+        raw = addresses[known].to_numpy(dtype=object)
+        self._raw, order = _sorted(raw)
+        self._raw_positions = positions[order]
+
+        # Searches go through the distinct addresses, so that an address
+        # with several DPE is found once
+        distinct = pd.unique(raw)
+        keys = _normalize_series(pd.Series(distinct, dtype="string"))
+        streets = np.array([street_key(key) for key in keys], dtype=object)
+        self._keys, order = _sorted(keys)
+        self._key_addresses = distinct[order]
+        self._streets, order = _sorted(streets)
+        self._street_addresses = distinct[order]
+
+    def __len__(self):
+        return len(self._raw)
+
+    def locate(self, address):
+        """
+        Row position of an address in the dataset, or None if unknown.
+        """
+        i = np.searchsorted(self._raw, address)
+        if i < len(self._raw) and self._raw[i] == address:
+            return int(self._raw_positions[i])
+        return None
+
+    def search(self, query, limit=50):
+        """
+        Up to ``limit`` addresses matching ``query``: addresses starting
+        with it, then streets starting with it, then close spellings.
+        """
+        key = normalize(query)
+        results = list(self._prefix(self._keys, self._key_addresses, key, limit))
+        if len(results) < limit:
+            results += self._prefix(self._streets, self._street_addresses, key, limit)
+        results = list(dict.fromkeys(results))
+        if len(results) < limit and key:
+            results += self._fuzzy(key, limit - len(results), set(results))
+        return results[:limit]
+
+    @staticmethod
+    def _prefix(keys, addresses, key, limit):
+        start = np.searchsorted(keys, key, side="left")
+        stop = np.searchsorted(keys, key + _END, side="left")
+        return addresses[start:min(stop, start + limit)].tolist()
+
+    def _fuzzy(self, key, limit, found, window=500):
+        # Only the neighbourhood of where the key would be inserted is
+        # compared, which keeps the cost bounded on large datasets; the
+        # addresses already ``found`` are left out
+        results = []
+        for keys, addresses in ((self._keys, self._key_addresses),
+                                (self._streets, self._street_addresses)):
+            i = np.searchsorted(keys, key)
+            lo, hi = max(i - window, 0), i + window
+            candidates = {k: address for k, address in zip(keys[lo:hi], addresses[lo:hi]) if address not in found}
+            for match in difflib.get_close_matches(key, list(candidates), n=limit, cutoff=FUZZY_CUTOFF):
+                if candidates[match] not in results:
+                    results.append(candidates[match])
+        return results[:limit]
@@ -0,0 +1,119 @@
+"""
+Additive aggregates of the dataset.
+
+Every table the pages derive their charts from is kept as counts and sums
+per key, so that the tables of two parts of the dataset merge by adding
+them up. This lets them be computed chunk by chunk, or updated with the
+rows of a new shard, without holding the whole dataset.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from dpe.cleaning import complete
+from dpe.cubes import (
+    CUBE_KEYS,
+    DEPARTEMENT,
+    LABEL_KINDS,
+    MONTH,
+    PEER_GROUP,
+    departement_cube,
+    label_cube,
+    peer_group_sums,
+)
+from dpe.stats import TYPE, monthly_sums
+
+# Keys of each aggregate table, the other columns are additive measures
+AGGREGATE_KEYS = {
+    "monthly_sums": ["month", TYPE],
+    "label_cube": [DEPARTEMENT, MONTH] + LABEL_KINDS,
+    "departement_cube": CUBE_KEYS,
+    "peer_group_sums": PEER_GROUP,
+}
+
+# Row count of each table, a cell is empty when it reaches 0
+COUNT_COLUMNS = {
+    "monthly_sums": "n",
+    "label_cube": "count",
+    "departement_cube": "rows",
+    "peer_group_sums": "rows",
+}
+
+
+def _plain_keys(table, keys):
+    # Keys as plain objects with NaN for missing values, so that tables
+    # built from different chunks (and categories) line up
+    for key in keys:
+        dtype = table[key].dtype
+        if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(dtype) or dtype == object:
+            column = table[key].astype(object)
+            table[key] = column.where(column.notna(), np.nan)
+    return table
+
+
+def compute_aggregates(dpe_data):
+    """
+    Aggregate tables of a cleaned (part of the) dataset, keys as columns.
+    """
+    tables = {
+        "monthly_sums": monthly_sums(complete(dpe_data)),
+        "label_cube": label_cube(dpe_data).reset_index(),
+        "departement_cube": departement_cube(dpe_data),
+        "peer_group_sums": peer_group_sums(dpe_data).reset_index(),
+    }
+    return {name: _plain_keys(table, AGGREGATE_KEYS[name]) for name, table in tables.items()}
+
+
+def merge_aggregates(*parts, sign=None):
+    """
+    Add up aggregate tables. ``sign`` optionally gives +1/-1 per part, to
+    subtract the contribution of removed rows.
+    """
+    sign = sign or [1] * len(parts)
+    merged = {}
+    for name, keys in AGGREGATE_KEYS.items():
+        tables = []
+        for part, factor in zip(parts, sign):
+            if part and name in part and len(part[name]):
+                table = part[name].copy()
+                measures = [col for col in table.columns if col not in keys]
+                table[measures] = table[measures] * factor
+                tables.append(table)
+        if not tables:
+            continue
+        table = pd.concat(tables, ignore_index=True)
+        table = table.groupby(keys, dropna=False, sort=True).sum().reset_index()
+        # Drop the cells emptied by a subtraction
+        table = table[table[COUNT_COLUMNS[name]] != 0]
+        merged[name] = _plain_keys(table.reset_index(drop=True), keys)
+    return merged
+
+
+def save_aggregates(aggregates, directory):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, table in aggregates.items():
+        tmp = directory / f"{name}.tmp"
+        table.to_parquet(tmp, index=False)
+        tmp.replace(directory / f"{name}.parquet")
+
+
+def load_aggregates(directory):
+    """
+    Aggregate tables saved in ``directory`` (missing ones are skipped).
+    """
+    aggregates = {}
+    for name in AGGREGATE_KEYS:
+        path = Path(directory) / f"{name}.parquet"
+        if path.exists():
+            aggregates[name] = pd.read_parquet(path)
+    return plain_keys(aggregates)
+
+
+def plain_keys(aggregates):
+    """
+    Aggregate tables read back from a file, with the keys of
+    ``compute_aggregates`` (plain objects, NaN when missing).
+    """
+    return {name: _plain_keys(table, AGGREGATE_KEYS[name]) for name, table in aggregates.items()}
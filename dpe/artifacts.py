@@ -0,0 +1,133 @@
+"""
+Precomputed tables of the pages.
+
+``python -m dpe.precompute`` runs the whole pipeline once and writes the
+tables every chart is derived from to a versioned folder of
+``<store>/artifacts``:
+
+- the additive aggregates of ``dpe.aggregates`` (trend sums, label cube,
+  departement cube, peer-group sums), finalized by the backend in
+  milliseconds,
+- the filter options of the Geographical overview,
+- the cleaned rows sorted by address, in small row groups, for the
+  address search and lookups of the Breakdown page.
+
+A ``manifest.json`` in the folder lists its tables and the fingerprints of
+the shards they come from, and the ``CURRENT`` file names the folder in
+use, so a new version is switched to atomically once complete.
+"""
+import hashlib
+import json
+import logging
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dpe.aggregates import save_aggregates
+from dpe.config import DATA_DIR, STORE_DIR
+from dpe.store import fingerprint, shard_paths
+
+logger = logging.getLogger(__name__)
+
+# Bump when the tables or their layout change
+ARTIFACT_VERSION = 3
+
+ARTIFACTS_NAME = "artifacts"
+CURRENT_NAME = "CURRENT"
+MANIFEST_NAME = "manifest.json"
+AGGREGATES_NAME = "aggregates"
+FILTER_OPTIONS_NAME = "filter_options.json"
+ADDRESSES_NAME = "addresses.parquet"
+
+# Rows per row group of the address table, the unit read by a lookup
+ADDRESS_ROW_GROUP = 8192
+
+
+def artifacts_dir(store_dir=STORE_DIR):
+    return Path(store_dir) / ARTIFACTS_NAME
+
+
+def source_fingerprints(data_dir=DATA_DIR):
+    return {path.name: fingerprint(path) for path in shard_paths(data_dir)}
+
+
+def current_artifacts(store_dir=STORE_DIR):
+    """
+    Folder of the tables in use, None if none were precomputed.
+    """
+    root = artifacts_dir(store_dir)
+    current = root / CURRENT_NAME
+    if not current.exists():
+        return None
+    directory = root / current.read_text(encoding="utf-8").strip()
+    manifest = read_artifact_manifest(directory)
+    if manifest is None or manifest["version"] != ARTIFACT_VERSION:
+        return None
+    return directory
+
+
+def read_artifact_manifest(directory):
+    path = Path(directory) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_current(directory, data_dir=DATA_DIR):
+    """
+    Whether the tables of ``directory`` come from the shards of
+    ``data_dir``. A data folder without shards (app workers without the
+    raw data) is not checked.
+    """
+    sources = source_fingerprints(data_dir)
+    return not sources or sources == read_artifact_manifest(directory)["sources"]
+
+
+def write_artifacts(aggregates, filter_options, rows, data_dir=DATA_DIR, store_dir=STORE_DIR, keep=2):
+    """
+    Write the tables to a new version folder, switch ``CURRENT`` to it and
+    delete the versions older than the last ``keep``. Return the manifest.
+    """
+    root = artifacts_dir(store_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    sources = source_fingerprints(data_dir)
+    digest = hashlib.sha1(json.dumps(sources, sort_keys=True).encode("utf-8")).hexdigest()
+    version = f"v{ARTIFACT_VERSION}-{digest[:12]}"
+    tmp = root / f".{version}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+
+    save_aggregates(aggregates, tmp / AGGREGATES_NAME)
+    with open(tmp / FILTER_OPTIONS_NAME, "w", encoding="utf-8") as f:
+        json.dump(filter_options, f, indent=2, ensure_ascii=False)
+    rows.sort_values("Adresse_(BAN)", kind="stable").to_parquet(
+        tmp / ADDRESSES_NAME, index=False, compression="zstd", row_group_size=ADDRESS_ROW_GROUP)
+
+    tables = {f"{AGGREGATES_NAME}/{name}": len(table) for name, table in aggregates.items()}
+    tables[ADDRESSES_NAME] = len(rows)
+    manifest = {
+        "version": ARTIFACT_VERSION,
+        "name": version,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "sources": sources,
+        "tables": tables,
+        "bytes": sum(path.stat().st_size for path in tmp.rglob("*") if path.is_file()),
+    }
+    with open(tmp / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    directory = root / version
+    shutil.rmtree(directory, ignore_errors=True)
+    tmp.rename(directory)
+    current = root / f"{CURRENT_NAME}.tmp"
+    current.write_text(version, encoding="utf-8")
+    current.replace(root / CURRENT_NAME)
+
+    versions = sorted((path for path in root.iterdir() if path.is_dir() and not path.name.startswith(".")),
+                      key=lambda path: path.stat().st_mtime, reverse=True)
+    for old in versions[keep:]:
+        if old != directory:
+            shutil.rmtree(old, ignore_errors=True)
+    logger.info("Wrote precomputed tables %s (%.1f MB)", version, manifest["bytes"] / 1e6)
+    return manifest
@@ -0,0 +1,514 @@
+"""
+Query backends answering the aggregations of the pages.
+
+- ``PandasBackend`` works on the cleaned dataset held in memory.
+- ``DuckDBBackend`` runs the aggregations as SQL over the parquet store
+  with an embedded DuckDB, so that memory follows the size of the results
+  rather than of the dataset. DuckDB is an optional dependency.
+- ``ArtifactBackend`` answers from the tables written by
+  ``python -m dpe.precompute``, without the raw data.
+
+They return the same frames; the setting ``DPE_BACKEND`` chooses one
+(see ``dpe.dataset.get_backend``), "auto" being the precomputed tables
+when there are some and the pandas backend otherwise.
+"""
+import json
+import logging
+from functools import cached_property
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from dpe.address_index import ADDRESS, FUZZY_CUTOFF, AddressIndex, normalize
+from dpe.aggregates import AGGREGATE_KEYS, compute_aggregates, load_aggregates
+from dpe.artifacts import (
+    ADDRESSES_NAME,
+    AGGREGATES_NAME,
+    FILTER_OPTIONS_NAME,
+    current_artifacts,
+    is_current,
+    read_artifact_manifest,
+)
+from dpe.cleaning import GHG, clean, fences
+from dpe.compaction import compact
+from dpe.config import DATA_DIR, INGEST, STORE_DIR
+from dpe.cubes import (
+    CUBE_KEYS,
+    DEPARTEMENT,
+    LABEL_KINDS,
+    MONTH,
+    PEER_GROUP,
+    departement_summary,
+    inefficient_breakdown,
+    label_table,
+    means_from_sums,
+    peer_means,
+)
+from dpe.filters import ETIQUETTE, filter_options
+from dpe.instrument import stage
+from dpe.label_timeline import LabelTimeline
+from dpe.row_index import INDEX_COLUMNS, ORDER_COLUMNS, RowIndex
+from dpe.schema import CART_ADRESS, CHART_CONSO, CHART_COUT, COLUMNS, DATE_COLUMN, GHG_OUTLIER
+from dpe.stats import TYPE, VALUE, WEIGHT, flag_anomalies, trend_from_sums
+from dpe.store import build_store, is_up_to_date, load_store, read_manifest
+from dpe.streaming import load_stream, load_stream_aggregates, stream_parts
+
+logger = logging.getLogger(__name__)
+
+
+class PandasBackend:
+    """
+    Aggregations over the in-memory dataset. Derived tables are computed on
+    first use from the additive aggregates of ``dpe.aggregates`` (given,
+    when ingested ahead of time, or computed from the rows) and kept with
+    the backend.
+    """
+
+    name = "pandas"
+
+    def __init__(self, dpe_data, aggregates=None):
+        self.dpe_data = dpe_data
+        self._given_aggregates = aggregates
+
+    @classmethod
+    def from_store(cls, data_dir=DATA_DIR, store_dir=STORE_DIR, ingest=INGEST):
+        if ingest == "stream":
+            dpe_data, _ = compact(load_stream(data_dir=data_dir, store_dir=store_dir))
+            return cls(dpe_data, load_stream_aggregates(data_dir, store_dir))
+        dpe_data, _ = compact(clean(load_store(data_dir=data_dir, store_dir=store_dir)))
+        return cls(dpe_data)
+
+    @cached_property
+    def address_index(self):
+        return AddressIndex(self.dpe_data["Adresse_(BAN)"])
+
+    @cached_property
+    def row_index(self):
+        with stage("row_index", rows_in=len(self.dpe_data)):
+            return RowIndex(self.dpe_data[INDEX_COLUMNS], self.dpe_data.__getitem__)
+
+    @cached_property
+    def _aggregates(self):
+        if self._given_aggregates:
+            return self._given_aggregates
+        with stage("aggregates", rows_in=len(self.dpe_data)):
+            return compute_aggregates(self.dpe_data)
+
+    @cached_property
+    def _trend(self):
+        return flag_anomalies(trend_from_sums(self._aggregates["monthly_sums"]))
+
+    @cached_property
+    def _label_cube(self):
+        return self._aggregates["label_cube"].set_index(AGGREGATE_KEYS["label_cube"])["count"]
+
+    @cached_property
+    def _label_table(self):
+        return label_table(self._label_cube)
+
+    @cached_property
+    def _label_timeline(self):
+        return LabelTimeline(self._label_cube)
+
+    @cached_property
+    def _peer_group_means(self):
+        return means_from_sums(self._aggregates["peer_group_sums"].set_index(PEER_GROUP)).sort_index()
+
+    @cached_property
+    def _departement_cube(self):
+        return self._aggregates["departement_cube"]
+
+    def aggregates(self):
+        return self._aggregates
+
+    @cached_property
+    def _filter_options(self):
+        return filter_options(self.dpe_data)
+
+    def filter_options(self):
+        """
+        Bounds of the year slider and options of the multiselects.
+        """
+        return self._filter_options
+
+    def monthly_trend(self):
+        return self._trend.copy()
+
+    def label_table(self):
+        return self._label_table
+
+    def label_timeline(self):
+        return self._label_timeline
+
+    def peer_means(self, type_batiment, etiquette_ges, etiquette_dpe):
+        return peer_means(self._peer_group_means, type_batiment, etiquette_ges, etiquette_dpe)
+
+    def departement_summary(self, year_range, building_types, categories):
+        return departement_summary(self._departement_cube, year_range, building_types, categories)
+
+    def inefficient_breakdown(self, year_range, building_types):
+        return inefficient_breakdown(self._departement_cube, year_range, building_types)
+
+    def search_addresses(self, query, limit=50):
+        return self.address_index.search(query, limit)
+
+    def address_row(self, address):
+        """
+        One-row frame of the DPE of an address (empty if unknown).
+        """
+        position = self.address_index.locate(address)
+        return self.dpe_data.iloc[[] if position is None else [position]]
+
+    def _rows_at(self, positions, columns):
+        return self.dpe_data.iloc[positions][columns].reset_index(drop=True)
+
+    def rows_page(self, year_range, building_types, categories, departements=None,
+                  sort_by=None, ascending=True, columns=None, page=0, page_size=50):
+        """
+        Page ``page`` (from 0) of the rows matching the filters, ordered by
+        departement, DPE label, date and address or by ``sort_by``, with
+        the given ``columns``, and the number of matching rows.
+        """
+        positions, total = self.row_index.page(page, page_size, year_range, building_types, categories,
+                                               departements, sort_by, ascending)
+        return self._rows_at(positions, list(columns or COLUMNS)), total
+
+
+class ArtifactBackend(PandasBackend):
+    """
+    Aggregations from the tables precomputed by ``dpe.precompute``. Only
+    small tables are loaded; the address search reads the address column
+    and a lookup reads the row group holding the address.
+    """
+
+    name = "artifacts"
+
+    def __init__(self, data_dir=DATA_DIR, store_dir=STORE_DIR, ingest=None):
+        # ``ingest`` is the one of the precompute run, kept for a common signature
+        directory = current_artifacts(store_dir)
+        if directory is None:
+            raise FileNotFoundError(f"No precomputed tables in {store_dir}, run python -m dpe.precompute")
+        if not is_current(directory, data_dir):
+            raise RuntimeError(f"The precomputed tables {directory.name} are older than the shards of {data_dir}, "
+                               "run python -m dpe.precompute")
+        self.directory = directory
+        self.manifest = read_artifact_manifest(directory)
+        super().__init__(None, load_aggregates(directory / AGGREGATES_NAME))
+
+    @cached_property
+    def address_index(self):
+        table = pq.read_table(self.directory / ADDRESSES_NAME, columns=[ADDRESS])
+        return AddressIndex(table.column(0).to_pandas())
+
+    def _read_column(self, column):
+        return pq.read_table(self.directory / ADDRESSES_NAME, columns=[column]).column(0).to_pandas()
+
+    @cached_property
+    def row_index(self):
+        with stage("row_index"):
+            keys = pq.read_table(self.directory / ADDRESSES_NAME, columns=INDEX_COLUMNS).to_pandas()
+            return RowIndex(keys, self._read_column)
+
+    def _rows_at(self, positions, columns):
+        # Only the row groups holding the window are read
+        table = pq.ParquetFile(self.directory / ADDRESSES_NAME)
+        sizes = [table.metadata.row_group(i).num_rows for i in range(table.num_row_groups)]
+        starts = np.concatenate([[0], np.cumsum(sizes)])
+        groups, inverse = np.unique(np.searchsorted(starts, positions, side="right") - 1, return_inverse=True)
+        rows = table.read_row_groups(groups.tolist(), columns=columns)
+        # Position of each row in the concatenation of the groups read
+        offsets = np.concatenate([[0], np.cumsum(np.asarray(sizes)[groups])])[:-1]
+        return rows.take(offsets[inverse] + positions - starts[groups][inverse]).to_pandas()
+
+    @cached_property
+    def _filter_options(self):
+        with open(self.directory / FILTER_OPTIONS_NAME, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def filter_options(self):
+        return self._filter_options
+
+    def address_row(self, address):
+        """
+        One-row frame of the DPE of an address (empty if unknown).
+        """
+        # The rows are sorted by address: the filter only reads one row group
+        table = pq.read_table(self.directory / ADDRESSES_NAME, filters=[(ADDRESS, "==", address)])
+        return table.slice(0, 1).to_pandas()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sql_list(paths):
+    return "[" + ", ".join("'" + str(path).replace("'", "''") + "'" for path in paths) + "]"
+
+
+# SQL version of dpe.address_index.normalize (accents, case, punctuation)
+_NORMALIZED = (
+    "trim(regexp_replace(regexp_replace(lower(strip_accents(\"Adresse_(BAN)\")), "
+    "'[^a-z0-9_]+', ' ', 'g'), ' +', ' ', 'g'))"
+)
+
+
+class DuckDBBackend:
+    """
+    Aggregations as SQL over the parquet parts of the store.
+
+    A view applies the cleaning of ``dpe.cleaning.clean`` (most recent DPE
+    per address, first in shard order for the same date, valid date, GHG
+    outlier flag) so that no query needs the rows in memory; only the
+    aggregated results are brought back to pandas, where the same
+    finalization functions as the pandas backend are applied. With
+    ``ingest="stream"`` the view reads the parts of ``dpe.streaming``.
+    """
+
+    name = "duckdb"
+
+    def __init__(self, data_dir=DATA_DIR, store_dir=STORE_DIR, ingest=INGEST):
+        try:
+            import duckdb
+        except ImportError as error:
+            raise ImportError("The duckdb backend needs the duckdb package: pip install duckdb") from error
+        self._con = duckdb.connect()
+        if ingest == "stream":
+            parts = stream_parts(data_dir, store_dir)
+        else:
+            if not is_up_to_date(data_dir, store_dir):
+                build_store(data_dir, store_dir)
+            parts = [Path(store_dir) / entry["part"] for entry in read_manifest(store_dir)["parts"].values()]
+        parts = _sql_list(parts)
+        columns = ", ".join(_quote(col) for col in COLUMNS)
+        date = _quote(DATE_COLUMN)
+        self._con.execute(f"""
+            CREATE VIEW dpe_rows AS
+            SELECT {columns} FROM (
+                SELECT *, row_number() OVER (
+                    PARTITION BY "Adresse_(BAN)"
+                    ORDER BY {date} DESC NULLS LAST, list_position({parts}, filename), file_row_number
+                ) AS duplicate
+                FROM read_parquet({parts}, filename = true, file_row_number = true)
+            )
+            WHERE duplicate = 1 AND {date} IS NOT NULL
+        """)
+        # The outlier bounds depend on every row: computed once, not per query
+        bounds = fences(*self._con.execute(
+            f"SELECT quantile_cont({_quote(GHG)}, 0.25), quantile_cont({_quote(GHG)}, 0.75) FROM dpe_rows"
+        ).fetchone())
+        flag = "false" if bounds is None else \
+            f"coalesce({_quote(GHG)} < {bounds[0]!r} OR {_quote(GHG)} > {bounds[1]!r}, false)"
+        self._con.execute(f"CREATE VIEW dpe AS SELECT *, {flag} AS {_quote(GHG_OUTLIER)} FROM dpe_rows")
+
+    def _query(self, sql, params=None):
+        # A cursor per query: the backend is shared by the session threads
+        return self._con.cursor().execute(sql, params or []).df()
+
+    @cached_property
+    def _trend(self):
+        filled = " AND ".join(f"{_quote(col)} IS NOT NULL" for col in CART_ADRESS + CHART_CONSO + CHART_COUT)
+        w, x = _quote(WEIGHT), _quote(VALUE)
+        known = f"{x} IS NOT NULL AND {w} IS NOT NULL"
+        sums = self._query(f"""
+            SELECT date_trunc('month', {_quote(DATE_COLUMN)})::TIMESTAMP AS month,
+                   {_quote(TYPE)},
+                   count(*) AS n,
+                   coalesce(sum({w}), 0) AS sw,
+                   coalesce(sum(CASE WHEN {known} THEN {w} END), 0) AS sw_x,
+                   coalesce(sum({w} * {x}), 0) AS swx,
+                   coalesce(sum({w} * {x} * {x}), 0) AS swx2
+            FROM dpe WHERE {filled}
+            GROUP BY ALL
+        """)
+        return flag_anomalies(trend_from_sums(sums.astype({"n": "int64"})))
+
+    @cached_property
+    def _label_cube(self):
+        cube = self._query(f"""
+            SELECT {_quote(DEPARTEMENT)},
+                   date_trunc('month', {_quote(DATE_COLUMN)})::TIMESTAMP AS {MONTH},
+                   {", ".join(_quote(kind) for kind in LABEL_KINDS)},
+                   count(*) AS count
+            FROM dpe GROUP BY ALL
+        """)
+        labels = [DEPARTEMENT] + LABEL_KINDS
+        cube[labels] = cube[labels].astype(object).where(cube[labels].notna(), np.nan)
+        cube[MONTH] = cube[MONTH].astype("datetime64[ns]")
+        return cube.astype({"count": "int64"}).set_index(AGGREGATE_KEYS["label_cube"])["count"]
+
+    @cached_property
+    def _label_table(self):
+        return label_table(self._label_cube)
+
+    @cached_property
+    def _label_timeline(self):
+        return LabelTimeline(self._label_cube)
+
+    @cached_property
+    def _peer_group_means(self):
+        keys = ", ".join(_quote(col) for col in PEER_GROUP)
+        known = " AND ".join(f"{_quote(col)} IS NOT NULL" for col in PEER_GROUP)
+        means = ", ".join(f"avg({_quote(col)}) AS {_quote(col)}" for col in CHART_COUT + CHART_CONSO)
+        table = self._query(f"SELECT {keys}, {means} FROM dpe WHERE {known} GROUP BY ALL")
+        return table.set_index(PEER_GROUP).sort_index()
+
+    @cached_property
+    def _departement_cube(self):
+        ghg, surface = _quote(VALUE), _quote(WEIGHT)
+        keys = ", ".join(_quote(col) for col in CUBE_KEYS[1:])
+        known = " AND ".join(f"{_quote(col)} IS NOT NULL" for col in CUBE_KEYS[1:])
+        cube = self._query(f"""
+            SELECT year({_quote(DATE_COLUMN)}) AS year, {keys},
+                   count(*) AS rows,
+                   count("N°DPE") AS n_dpe,
+                   coalesce(sum({ghg}), 0) AS ghg_sum,
+                   count({ghg}) AS ghg_n,
+                   coalesce(sum({surface}), 0) AS surface_sum
+            FROM dpe WHERE {known}
+            GROUP BY ALL
+            ORDER BY ALL
+        """)
+        return cube.astype({key: object for key in CUBE_KEYS[1:]})
+
+    @cached_property
+    def _filter_options(self):
+        bounds = self._query(f"""
+            SELECT min(year({_quote(DATE_COLUMN)})) AS min_year,
+                   max(year({_quote(DATE_COLUMN)})) AS max_year
+            FROM dpe
+        """).iloc[0]
+        distinct = {}
+        for key, col in (("building_types", TYPE), ("categories", "Etiquette_DPE")):
+            values = self._query(f"SELECT DISTINCT {_quote(col)} AS v FROM dpe WHERE {_quote(col)} IS NOT NULL ORDER BY v")
+            distinct[key] = values["v"].tolist()
+        return {"min_year": int(bounds["min_year"]), "max_year": int(bounds["max_year"]), **distinct}
+
+    def filter_options(self):
+        return self._filter_options
+
+    def monthly_trend(self):
+        return self._trend.copy()
+
+    def label_table(self):
+        return self._label_table
+
+    def label_timeline(self):
+        return self._label_timeline
+
+    def peer_means(self, type_batiment, etiquette_ges, etiquette_dpe):
+        return peer_means(self._peer_group_means, type_batiment, etiquette_ges, etiquette_dpe)
+
+    def departement_summary(self, year_range, building_types, categories):
+        return departement_summary(self._departement_cube, year_range, building_types, categories)
+
+    def inefficient_breakdown(self, year_range, building_types):
+        return inefficient_breakdown(self._departement_cube, year_range, building_types)
+
+    @cached_property
+    def _address_keys(self):
+        # Search keys of the addresses, normalized once rather than per query
+        street = f"regexp_replace({_NORMALIZED}, '^[0-9]+ *(bis|ter|quater|[a-z])? +', '')"
+        self._con.execute(f"""
+            CREATE OR REPLACE TABLE address_keys AS
+            SELECT DISTINCT "Adresse_(BAN)" AS address, {_NORMALIZED} AS key, {street} AS street FROM dpe
+            WHERE "Adresse_(BAN)" IS NOT NULL
+        """)
+        return "address_keys"
+
+    def search_addresses(self, query, limit=50):
+        """
+        Addresses starting with the query, then streets starting with it,
+        then the close spellings (as ``dpe.address_index.AddressIndex``).
+        """
+        key = normalize(query)
+        found = self._query(f"""
+            SELECT address FROM {self._address_keys}
+            WHERE starts_with(key, ?) OR starts_with(street, ?)
+            ORDER BY NOT starts_with(key, ?), CASE WHEN starts_with(key, ?) THEN key ELSE street END
+            LIMIT ?
+        """, [key, key, key, key, limit])["address"].tolist()
+        if len(found) < limit and key:
+            found += self._query(f"""
+                SELECT address FROM (
+                    SELECT address, greatest(jaro_winkler_similarity(key, ?),
+                                             jaro_winkler_similarity(street, ?)) AS similarity
+                    FROM {self._address_keys}
+                )
+                WHERE similarity >= ? AND NOT list_contains(?::VARCHAR[], address)
+                ORDER BY similarity DESC, address
+                LIMIT ?
+            """, [key, key, FUZZY_CUTOFF, found, limit - len(found)])["address"].tolist()
+        return list(dict.fromkeys(found))[:limit]
+
+    def address_row(self, address):
+        """
+        One-row frame of the DPE of an address (empty if unknown).
+        """
+        return self._query('SELECT * FROM dpe WHERE "Adresse_(BAN)" = ? LIMIT 1', [address])
+
+    def rows_page(self, year_range, building_types, categories, departements=None,
+                  sort_by=None, ascending=True, columns=None, page=0, page_size=50):
+        """
+        Page ``page`` (from 0) of the rows matching the filters, ordered by
+        departement, DPE label, date and address or by ``sort_by``, with
+        the given ``columns``, and the number of matching rows.
+        """
+        conditions = [f"year({_quote(DATE_COLUMN)}) BETWEEN ? AND ?", f"list_contains(?, {_quote(TYPE)})"]
+        params = [int(year_range[0]), int(year_range[1]), list(building_types)]
+        for col, selected in ((ETIQUETTE, categories), (DEPARTEMENT, departements)):
+            if selected is not None:
+                # A missing value in the selection keeps the rows without one
+                known = [value for value in selected if not pd.isna(value)]
+                missing = f" OR {_quote(col)} IS NULL" if len(known) < len(selected) else ""
+                conditions.append(f"(list_contains(?::VARCHAR[], {_quote(col)}){missing})")
+                params.append(known)
+        where = " AND ".join(conditions)
+        order = [f"{_quote(col)} NULLS LAST" for col in ORDER_COLUMNS]
+        if sort_by is not None:
+            order.insert(0, f"{_quote(sort_by)} {'ASC' if ascending else 'DESC'} NULLS LAST")
+        selected = ", ".join(_quote(col) for col in columns or COLUMNS)
+        rows = self._query(f"""
+            SELECT {selected} FROM dpe WHERE {where}
+            ORDER BY {", ".join(order)}
+            LIMIT ? OFFSET ?
+        """, params + [page_size, page * page_size])
+        total = self._query(f"SELECT count(*) AS n FROM dpe WHERE {where}", params)["n"].iloc[0]
+        return rows, int(total)
+
+
+BACKENDS = {
+    PandasBackend.name: PandasBackend.from_store,
+    DuckDBBackend.name: DuckDBBackend,
+    ArtifactBackend.name: ArtifactBackend,
+}
+
+
+def resolve_backend(name, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Name of the backend to use for the ``name`` setting, resolving "auto":
+    the precomputed tables when they come from the current shards, else
+    the pandas backend.
+    """
+    if name != "auto":
+        return name
+    directory = current_artifacts(store_dir)
+    if directory is None:
+        return PandasBackend.name
+    if not is_current(directory, data_dir):
+        logger.warning("The precomputed tables %s are older than the shards of %s, using the pandas backend",
+                       directory.name, data_dir)
+        return PandasBackend.name
+    return ArtifactBackend.name
+
+
+def create_backend(name, data_dir=DATA_DIR, store_dir=STORE_DIR, ingest=INGEST):
+    """
+    Backend registered under ``name`` ("pandas", "duckdb", "artifacts" or
+    "auto").
+    """
+    name = resolve_backend(name, data_dir, store_dir)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](data_dir=data_dir, store_dir=store_dir, ingest=ingest)
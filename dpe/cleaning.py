@@ -0,0 +1,144 @@
+"""
+Cleaning rules applied once to the loaded dataset.
+
+- DPE without a valid date are dropped,
+- one DPE is kept per address, the most recent one (the first one in
+  shard order among those of the same date),
+- GHG emissions per m² far out of the range of the others are flagged in
+  the ``GHG_OUTLIER`` column.
+
+The number of rows each rule drops or flags is kept as a quality report in
+``attrs["quality"]`` of the cleaned frame.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from dpe.schema import CART_ADRESS, CHART_CONSO, CHART_COUT, DATE_COLUMN, GHG_OUTLIER
+
+ADDRESS = "Adresse_(BAN)"
+GHG = "Emission_GES_5_usages_par_m²"
+
+# Outliers are past this many interquartile ranges from the quartiles
+OUTLIER_IQR = 3
+
+QUALITY_NAME = "quality.json"
+
+# Missing date as int64 nanoseconds
+NAT = np.datetime64("NaT", "ns").astype(np.int64)
+
+
+def hash_addresses(addresses):
+    """
+    64-bit hashes of the addresses of a series, 0 for a missing address
+    (all the missing addresses count as one, as with ``drop_duplicates``).
+    Unlike codes, they can be compared between chunks of the dataset.
+    """
+    addresses = pd.Series(addresses)
+    known = addresses.notna().to_numpy()
+    hashes = np.zeros(len(addresses), dtype=np.uint64)
+    hashes[known] = pd.util.hash_array(addresses[known].to_numpy(dtype=object).astype(str))
+    return hashes
+
+
+def dates_as_int(dates):
+    """
+    Dates as int64 nanoseconds, missing dates lowest.
+    """
+    return pd.Series(dates).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+
+
+def latest_per_address(addresses, dates):
+    """
+    Positions, in order, of the most recent row of every address (values
+    or hashes, a missing one counting as one address), the first one for
+    rows of the same date.
+    """
+    # One hash table pass numbering the addresses, then two scatter passes
+    codes, uniques = pd.factorize(addresses, use_na_sentinel=False)
+    latest = np.full(len(uniques), np.iinfo(np.int64).min)
+    np.maximum.at(latest, codes, dates)
+    candidates = np.flatnonzero(dates == latest[codes])
+    first = np.full(len(uniques), len(codes))
+    np.minimum.at(first, codes[candidates], candidates)
+    return np.sort(first)
+
+
+def drop_undated(dpe_data):
+    """
+    Drop the DPE without a valid date.
+    """
+    return dpe_data.dropna(subset=[DATE_COLUMN])
+
+
+def fences(q1, q3):
+    """
+    Range of the GHG emissions per m² not flagged as outliers from their
+    quartiles: the Tukey fences at ``OUTLIER_IQR`` interquartile ranges,
+    never below 0. None without any emission.
+    """
+    if q1 is None or np.isnan(q1):
+        return None
+    return max(float(q1 - OUTLIER_IQR * (q3 - q1)), 0.0), float(q3 + OUTLIER_IQR * (q3 - q1))
+
+
+def outlier_bounds(ghg):
+    return fences(*ghg.astype("float64").quantile([0.25, 0.75]))
+
+
+def flag_outliers(dpe_data):
+    """
+    Add the ``GHG_OUTLIER`` flag to the rows, return them and the bounds.
+    """
+    ghg = dpe_data[GHG].astype("float64")
+    bounds = outlier_bounds(ghg)
+    flags = np.zeros(len(dpe_data), dtype=bool) if bounds is None else \
+        ((ghg < bounds[0]) | (ghg > bounds[1])).to_numpy()
+    return dpe_data.assign(**{GHG_OUTLIER: flags}), bounds
+
+
+def clean(dpe_data):
+    """
+    Apply the cleaning rules in one pass over the rows, with the quality
+    report in ``attrs["quality"]``.
+    """
+    dates = dates_as_int(dpe_data[DATE_COLUMN])
+    dated = np.flatnonzero(dates != NAT)
+    kept = dated[latest_per_address(dpe_data[ADDRESS].iloc[dated], dates[dated])]
+    deduplicated = dpe_data.iloc[kept].reset_index(drop=True)
+    cleaned, bounds = flag_outliers(deduplicated)
+    cleaned.attrs["quality"] = quality_report(len(dpe_data), len(dpe_data) - len(dated), len(dated) - len(kept),
+                                              cleaned, bounds)
+    return cleaned
+
+
+def quality_report(rows_in, undated, duplicates, cleaned, bounds):
+    """
+    Rows read, dropped and flagged by each rule.
+    """
+    return {
+        "rows_in": int(rows_in),
+        "dropped_undated": int(undated),
+        "dropped_duplicates": int(duplicates),
+        "rows_out": len(cleaned),
+        "flagged_ghg_outliers": int(cleaned[GHG_OUTLIER].sum()),
+        "ghg_bounds": None if bounds is None else [float(bound) for bound in bounds],
+    }
+
+
+def write_quality_report(report, store_dir):
+    path = Path(store_dir) / QUALITY_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    tmp.replace(path)
+
+
+def complete(dpe_data):
+    """
+    Keep the rows with every address cart, consumption and cost field filled.
+    """
+    return dpe_data.dropna(subset=CART_ADRESS + CHART_CONSO + CHART_COUT).reset_index(drop=True)
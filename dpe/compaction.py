@@ -0,0 +1,73 @@
+"""
+Compact in-memory representation of the dataset.
+
+Repeated strings become categoricals and numeric columns are downcast to
+the smallest type holding exactly the same values (int16 for small
+integers, float32 when every value round-trips). Values with decimals
+rarely fit in float32, so the emission, surface and consumption columns
+mostly stay float64: the sums of the trend and the cubes are then the
+same as on the raw data. Columns not used by the pages are dropped.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+from dpe.schema import COLUMNS, GHG_OUTLIER
+
+logger = logging.getLogger(__name__)
+
+# Share of distinct values under which a text column becomes categorical
+CATEGORY_RATIO = 0.5
+
+
+def _downcast_float(values):
+    known = values[~np.isnan(values)]
+    if len(known) and np.all(known == np.round(known)):
+        info = np.iinfo(np.int16)
+        if len(known) == len(values) and known.min() >= info.min and known.max() <= info.max:
+            return values.astype(np.int16)
+    small = values.astype(np.float32)
+    # Only when lossless: every value converts back to itself
+    if np.array_equal(small.astype(np.float64), values, equal_nan=True):
+        return small
+    return values
+
+
+def compact_column(column):
+    """
+    Smallest representation of a column (the column itself if none).
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.remove_unused_categories()
+    if pd.api.types.is_float_dtype(column.dtype):
+        return pd.Series(_downcast_float(column.to_numpy(dtype=np.float64)), index=column.index, name=column.name)
+    if pd.api.types.is_integer_dtype(column.dtype):
+        return pd.to_numeric(column, downcast="integer")
+    if pd.api.types.is_string_dtype(column.dtype) or column.dtype == object:
+        if column.nunique(dropna=True) <= CATEGORY_RATIO * max(len(column), 1):
+            return column.astype("category")
+    return column
+
+
+def compact(dpe_data, columns=COLUMNS + [GHG_OUTLIER]):
+    """
+    Return the compacted frame and a report of the memory used before and
+    after, with the dtype changes.
+    """
+    before = int(dpe_data.memory_usage(deep=True).sum())
+    kept = [col for col in dpe_data.columns if col in columns]
+    compacted = pd.DataFrame({col: compact_column(dpe_data[col]) for col in kept}, index=dpe_data.index)
+    after = int(compacted.memory_usage(deep=True).sum())
+    report = {
+        "rows": len(dpe_data),
+        "bytes_before": before,
+        "bytes_after": after,
+        "dropped_columns": [col for col in dpe_data.columns if col not in columns],
+        "dtypes": {
+            col: [str(dpe_data[col].dtype), str(compacted[col].dtype)]
+            for col in kept if dpe_data[col].dtype != compacted[col].dtype
+        },
+    }
+    logger.info("Compacted %d rows from %.1f MB to %.1f MB", len(dpe_data), before / 1e6, after / 1e6)
+    return compacted, report
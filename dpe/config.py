@@ -0,0 +1,42 @@
+"""
+Runtime settings of the app, overridable through environment variables.
+"""
+import os
+from pathlib import Path
+
+# Folder holding the dpe-v2-logements-neufs-*.csv shards and the geojson
+DATA_DIR = Path(os.environ.get("DPE_DATA_DIR", "data"))
+
+# Folder where the typed columnar copy of the shards is written
+STORE_DIR = Path(os.environ.get("DPE_STORE_DIR", DATA_DIR / "store"))
+
+# Folder of the dataset and aggregates shared by the worker processes
+# (see dpe/shared_cache.py) and its size limit in MB, 0 to disable it
+CACHE_DIR = Path(os.environ.get("DPE_CACHE_DIR", STORE_DIR / "cache"))
+CACHE_MAX_MB = int(os.environ.get("DPE_CACHE_MAX_MB", 2000))
+
+# Query backend of the pages: "pandas" (in memory), "duckdb" (SQL over the
+# store), "artifacts" (tables of python -m dpe.precompute) or "auto" (the
+# precomputed tables if any, else pandas)
+BACKEND = os.environ.get("DPE_BACKEND", "auto")
+
+# How the shards are loaded: "store" (whole shards, cleaned in memory) or
+# "stream" (cleaned block by block ahead of time, see dpe/streaming.py)
+INGEST = os.environ.get("DPE_INGEST", "store")
+
+# Show the debug panel of the pages (also with ?debug=1 in the url)
+DEBUG = os.environ.get("DPE_DEBUG", "0").lower() in ("1", "true", "yes")
+
+# Threads computing the heavy sections of the pages in the background,
+# shared by the sessions of a process (see dpe/sections.py)
+SECTION_WORKERS = int(os.environ.get("DPE_SECTION_WORKERS", 4))
+
+# Most points a chart sends to the browser (see dpe/reduction.py)
+POINT_BUDGET = int(os.environ.get("DPE_POINT_BUDGET", 5000))
+
+# Replace the anomalous months of the trend series by the median of the
+# months around them (see dpe/stats.py), rather than only flagging them
+TREND_CORRECTION = os.environ.get("DPE_TREND_CORRECTION", "1").lower() in ("1", "true", "yes")
+
+# Evaluate the Vega transforms of the charts on the server (needs vegafusion)
+VEGAFUSION = os.environ.get("DPE_VEGAFUSION", "0").lower() in ("1", "true", "yes")
@@ -0,0 +1,157 @@
+"""
+Pre-aggregated tables of the dataset (counts, means), built once and queried
+by the pages without scanning the rows again.
+"""
+import pandas as pd
+
+from dpe.schema import CHART_CONSO, CHART_COUT, DATE_COLUMN
+
+DEPARTEMENT = "N°_département_(BAN)"
+LABELS = ["A", "B", "C", "D", "E", "F", "G"]
+LABEL_KINDS = ["Etiquette_DPE", "Etiquette_GES"]
+MONTH = "month"
+PEER_GROUP = ["Type_bâtiment", "Etiquette_GES", "Etiquette_DPE"]
+GHG = "Emission_GES_5_usages_par_m²"
+SURFACE = "Surface_habitable_logement"
+INEFFICIENT = ["E", "F", "G"]
+CUBE_KEYS = ["year", "Type_bâtiment", "Etiquette_DPE", DEPARTEMENT]
+
+
+def label_cube(dpe_data):
+    """
+    Number of DPE per (département, month, DPE label, GES label). Missing
+    values are kept as their own cell so that the totals match the row
+    counts.
+    """
+    month = dpe_data[DATE_COLUMN].dt.to_period("M").dt.to_timestamp().rename(MONTH)
+    return (
+        dpe_data
+        .groupby([dpe_data[DEPARTEMENT], month] + [dpe_data[kind] for kind in LABEL_KINDS],
+                 dropna=False, observed=True)
+        .size()
+        .rename("count")
+    )
+
+
+def label_table(cube):
+    """
+    Collapse the cube into one row per département holding the counts of
+    each DPE and GES label, columns ``(kind, label)``.
+    """
+    tables = {}
+    for kind in LABEL_KINDS:
+        tables[kind] = (
+            cube
+            .groupby(level=[DEPARTEMENT, kind], dropna=False, observed=True)
+            .sum()
+            .unstack(fill_value=0)
+            .reindex(columns=LABELS, fill_value=0)
+        )
+    table = pd.concat(tables, axis=1).fillna(0)
+    table.index = table.index.astype(object)
+    return table.sort_index(na_position="last")
+
+
+def peer_group_sums(dpe_data):
+    """
+    Number of DPE (``rows``), sum (``<column>``) and count of known values
+    (``<column>_n``) of every cost and consumption column per peer group,
+    i.e. per (building type, GES label, DPE label). Sums of several parts
+    of the dataset add up.
+    """
+    # Summed in float64 whatever the storage type of the columns
+    values = dpe_data[CHART_COUT + CHART_CONSO].astype("float64")
+    counts = values.notna().astype("int64").add_suffix("_n")
+    rows = pd.Series(1, index=dpe_data.index, name="rows")
+    keys = [dpe_data[key] for key in PEER_GROUP]
+    return pd.concat([rows, values, counts], axis=1).groupby(keys, observed=True).sum()
+
+
+def means_from_sums(sums):
+    """
+    Peer-group means from ``peer_group_sums``.
+    """
+    columns = CHART_COUT + CHART_CONSO
+    means = sums[columns] / sums[[f"{col}_n" for col in columns]].to_numpy()
+    return means.where(sums[[f"{col}_n" for col in columns]].to_numpy() > 0)
+
+
+def peer_group_means(dpe_data):
+    """
+    Mean of every cost and consumption column per peer group.
+    """
+    return means_from_sums(peer_group_sums(dpe_data))
+
+
+def peer_means(means, type_batiment, etiquette_ges, etiquette_dpe):
+    """
+    Means of the peer group of a DPE (NaN when the group is unknown).
+    """
+    key = (type_batiment, etiquette_ges, etiquette_dpe)
+    return means.reindex(pd.MultiIndex.from_tuples([key], names=PEER_GROUP)).iloc[0]
+
+
+def departement_cube(dpe_data):
+    """
+    Additive measures per (year, building type, DPE label, département):
+
+    - rows: number of DPE
+    - n_dpe: number of DPE with a number (N°DPE)
+    - ghg_sum, ghg_n: sum and count of the known GHG emissions per m²
+    - surface_sum: sum of the habitable surfaces
+
+    Any filter on the keys is answered by summing the matching cells.
+    """
+    ghg = dpe_data[GHG].astype("float64")
+    measures = pd.DataFrame({
+        "year": dpe_data[DATE_COLUMN].dt.year.astype("Int16"),
+        "Type_bâtiment": dpe_data["Type_bâtiment"],
+        "Etiquette_DPE": dpe_data["Etiquette_DPE"],
+        DEPARTEMENT: dpe_data[DEPARTEMENT],
+        "rows": 1,
+        "n_dpe": dpe_data["N°DPE"].notna().astype(int),
+        "ghg_sum": ghg.fillna(0),
+        "ghg_n": ghg.notna().astype(int),
+        "surface_sum": dpe_data[SURFACE].astype("float64").fillna(0),
+    })
+    cube = measures.groupby(CUBE_KEYS, observed=True).sum().reset_index()
+    for key in CUBE_KEYS[1:]:
+        cube[key] = cube[key].astype(object)
+    return cube
+
+
+def _select(cube, year_range, building_types, categories=None):
+    mask = cube["year"].between(*year_range) & cube["Type_bâtiment"].isin(building_types)
+    if categories is not None:
+        mask &= cube["Etiquette_DPE"].isin(categories)
+    return cube[mask]
+
+
+def departement_summary(cube, year_range, building_types, categories):
+    """
+    Metrics of the map per département: total_new (DPE count), efg_count,
+    efg_percent and ghg_m2_avg (mean GHG per m²).
+    """
+    cells = _select(cube, year_range, building_types, categories)
+    cells = cells.assign(efg_rows=cells["rows"].where(cells["Etiquette_DPE"].isin(INEFFICIENT), 0))
+    sums = cells.groupby(DEPARTEMENT)[["n_dpe", "efg_rows", "ghg_sum", "ghg_n"]].sum()
+    summary = pd.DataFrame({
+        "departement": sums.index.astype(str),
+        "total_new": sums["n_dpe"].to_numpy(),
+        "efg_count": sums["efg_rows"].to_numpy(),
+        "ghg_m2_avg": (sums["ghg_sum"] / sums["ghg_n"]).to_numpy(),
+    })
+    summary["efg_percent"] = summary["efg_count"] / summary["total_new"]
+    return summary
+
+
+def inefficient_breakdown(cube, year_range, building_types):
+    """
+    Count and mean GHG per m² of the E/F/G DPE per (département, label).
+    """
+    cells = _select(cube, year_range, building_types, INEFFICIENT)
+    sums = cells.groupby([DEPARTEMENT, "Etiquette_DPE"])[["n_dpe", "ghg_sum", "ghg_n"]].sum()
+    return pd.DataFrame({
+        "building_count": sums["n_dpe"],
+        "avg_GHG": sums["ghg_sum"] / sums["ghg_n"],
+    }).reset_index()
@@ -0,0 +1,71 @@
+"""
+Cached, cleaned DPE dataset and query backend shared by all the pages.
+
+The objects are built once per process with ``st.cache_resource`` and the
+same object is handed to every session and page: treat them as read-only
+and derive new frames instead of modifying them in place (the columns of
+the dataset are mapped from files shared by the processes). Calls and misses
+of the caches are counted by ``dpe.instrument``.
+"""
+import streamlit as st
+
+from dpe.backends import PandasBackend, create_backend, resolve_backend
+from dpe.config import BACKEND, INGEST
+from dpe.geo import load_variant
+from dpe.instrument import counted_cache, stage
+from dpe.shared_cache import cached_aggregates, cached_dataset
+from dpe.streaming import load_stream_aggregates
+
+
+@counted_cache(st.cache_resource, show_spinner="Loading the DPE dataset...")
+def get_dataset():
+    """
+    Deduplicated, cleaned and compacted dataset used by every page, mapped
+    from the cache shared by the worker processes (see dpe/shared_cache.py).
+    The reports of the cleaning and compaction are kept in
+    ``attrs["quality"]`` and ``attrs["compaction"]``.
+    """
+    return cached_dataset()
+
+
+@counted_cache(st.cache_resource)
+def get_aggregates():
+    """
+    Aggregates written by the streaming ingestion, else computed from the
+    dataset once for all the worker processes.
+    """
+    return load_stream_aggregates() if INGEST == "stream" else cached_aggregates(get_dataset())
+
+
+@counted_cache(st.cache_resource, show_spinner=False)
+def get_backend(name=BACKEND):
+    """
+    Backend answering the aggregations of the pages (see dpe/backends.py),
+    chosen with the DPE_BACKEND setting. The page sections get it from their
+    worker threads, behind their placeholder (see dpe/sections.py).
+    """
+    name = resolve_backend(name)
+    if name == PandasBackend.name:
+        return PandasBackend(get_dataset(), get_aggregates())
+    return create_backend(name)
+
+
+def load_backend():
+    """
+    ``get_backend()`` for the script thread, with a spinner while it is built.
+    """
+    with st.spinner("Preparing the DPE queries..."):
+        return get_backend()
+
+
+@counted_cache(st.cache_resource, show_spinner=False)
+def get_departements_geojson(tolerance):
+    """
+    Boundaries of the départements simplified at ``tolerance`` degrees.
+    Loaded by the map section in the background (see dpe/sections.py), so
+    without a spinner of its own.
+    """
+    with stage("geojson") as record:
+        geojson = load_variant(tolerance)
+        record["rows_out"] = len(geojson["features"])
+    return geojson
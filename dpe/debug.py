@@ -0,0 +1,76 @@
+"""
+Debug panel of the pages, showing the records of ``dpe.instrument``.
+
+The panel is shown in the sidebar when the DPE_DEBUG setting is on or the
+page is opened with ``?debug=1``. Chart payload sizes are only measured
+then, as it takes an extra serialization of the chart.
+"""
+import json
+
+import altair as alt
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from dpe.config import DEBUG
+from dpe.instrument import cache_stats, context, record_payload, records, set_context, stage
+
+
+def debug_enabled():
+    return DEBUG or st.query_params.get("debug") == "1"
+
+
+def start_page(page):
+    """
+    Tag the records of this script run with the page, session and run.
+    """
+    ctx = get_script_run_ctx()
+    run = st.session_state.get("_debug_run", 0) + 1
+    st.session_state["_debug_run"] = run
+    set_context(page=page, session=ctx.session_id if ctx else None, run=run)
+
+
+def track_chart(name, chart):
+    """
+    Return ``chart`` (Altair or Plotly), recording the size of its JSON
+    specification when debugging.
+    """
+    if debug_enabled():
+        with stage(f"serialize:{name}"):
+            # Altair charts are compiled to Vega on the server with vegafusion
+            if isinstance(chart, alt.TopLevelMixin) and alt.data_transformers.active == "vegafusion":
+                payload = chart.to_json(format="vega")
+            else:
+                payload = chart.to_json()
+        record_payload(name, len(payload.encode("utf-8")))
+    return chart
+
+
+def debug_panel():
+    """
+    Stages of the current run, payloads, caches and the export of every
+    record of the process.
+    """
+    if not debug_enabled():
+        return
+    with st.sidebar.expander("🛠️ Debug", expanded=False):
+        current = pd.DataFrame(records(**context()))
+        if current.empty:
+            st.caption("No stage recorded in this run.")
+        else:
+            stages = current[~current["stage"].str.startswith("payload:")]
+            st.caption("Stages of this run")
+            st.dataframe(stages.reindex(columns=["stage", "seconds", "rows_in", "rows_out", "memory_mb"]),
+                         hide_index=True)
+            payloads = current[current["stage"].str.startswith("payload:")]
+            if not payloads.empty:
+                st.caption("Chart payloads (bytes)")
+                st.dataframe(payloads[["stage", "bytes"]], hide_index=True)
+        st.caption("Caches")
+        st.dataframe(pd.DataFrame(cache_stats()).T, use_container_width=True)
+
+        everything = records()
+        st.download_button("Export JSON", json.dumps(everything, default=str), "dpe-stages.json",
+                           mime="application/json")
+        st.download_button("Export CSV", pd.DataFrame(everything).to_csv(index=False), "dpe-stages.csv",
+                           mime="text/csv")
@@ -0,0 +1,43 @@
+"""
+Filters of the Geographical overview sidebar.
+
+The map and E/F/G charts are answered from the département cube (see
+dpe/cubes.py), so the rows are only read once for the bounds of the year
+slider and the options of the multiselects.
+"""
+import numpy as np
+import pandas as pd
+
+from dpe.schema import DATE_COLUMN
+
+TYPE = "Type_bâtiment"
+ETIQUETTE = "Etiquette_DPE"
+
+
+def filter_key(year_range, building_types, categories=None):
+    """
+    Hashable key of a filter state, independent of the selection order.
+    """
+    return (
+        tuple(int(year) for year in year_range),
+        tuple(sorted(building_types)),
+        None if categories is None else tuple(sorted(categories)),
+    )
+
+
+def _options(column):
+    # Sorted distinct values, without the missing one
+    return sorted(pd.unique(np.asarray(column.dropna(), dtype=object)))
+
+
+def filter_options(dpe_data):
+    """
+    Bounds of the year slider and options of the multiselects.
+    """
+    years = dpe_data[DATE_COLUMN].dt.year.dropna()
+    return {
+        "min_year": int(years.min()) if len(years) else None,
+        "max_year": int(years.max()) if len(years) else None,
+        "building_types": _options(dpe_data[TYPE]),
+        "categories": _options(dpe_data[ETIQUETTE]),
+    }
@@ -0,0 +1,258 @@
+"""
+Simplified variants of the département boundaries.
+
+The GeoJSON is turned once into a topology: coordinates are quantized to
+integers and every ring is cut into arcs at the points where borders meet,
+so that a border shared by two départements is stored (and simplified)
+only once. Each arc is simplified with Douglas-Peucker at a few
+tolerances; since both neighbours use the same simplified arc, no gap or
+overlap appears between them. The variants are written as gzipped,
+delta-encoded TopoJSON and decoded back to GeoJSON for plotly.
+
+Run ``python -m dpe.geo`` to build the variants ahead of time.
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from dpe.config import DATA_DIR, STORE_DIR
+from dpe.store import fingerprint
+
+GEOJSON_PATH = DATA_DIR / "departements.geojson"
+GEO_DIR = STORE_DIR / "geo"
+
+# Coordinates are kept to 5 decimals (about 1 m)
+SCALE = 100_000
+
+# Simplification tolerances in degrees, from the most to the least detailed
+TOLERANCES = (0.0005, 0.002, 0.01)
+
+
+def _quantize(ring):
+    points = [(round(x * SCALE), round(y * SCALE)) for x, y in ring]
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    # Drop repeated points
+    return [p for i, p in enumerate(points) if p != points[i - 1]]
+
+
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+def build_topology(geojson):
+    """
+    Split the rings of the features into shared arcs.
+
+    Returns the list of arcs (lists of integer points) and, per feature, its
+    properties and polygons as lists of rings of arc references (``~i``
+    being arc ``i`` reversed, as in TopoJSON).
+    """
+    rings = []
+    neighbours = defaultdict(set)
+    for feature in geojson["features"]:
+        for polygon in _polygons(feature["geometry"]):
+            for ring in polygon:
+                points = _quantize(ring)
+                rings.append(points)
+                for i, point in enumerate(points):
+                    neighbours[point].add(points[i - 1])
+                    neighbours[point].add(points[(i + 1) % len(points)])
+    # Points where more than two borders meet
+    junctions = {point for point, near in neighbours.items() if len(near) > 2}
+
+    arcs, arc_ids = [], {}
+
+    def arc_ref(points):
+        key, reverse = tuple(points), tuple(reversed(points))
+        if key in arc_ids:
+            return arc_ids[key]
+        if reverse in arc_ids:
+            return ~arc_ids[reverse]
+        arc_ids[key] = len(arcs)
+        arcs.append(points)
+        return arc_ids[key]
+
+    ring_arcs = []
+    for points in rings:
+        cuts = [i for i, point in enumerate(points) if point in junctions]
+        start = cuts[0] if cuts else points.index(min(points))
+        points = points[start:] + points[:start]
+        cuts = [i for i, point in enumerate(points) if point in junctions] or [0]
+        cuts.append(len(points))
+        closed = points + points[:1]
+        ring_arcs.append([arc_ref(closed[a:b + 1]) for a, b in zip(cuts, cuts[1:])])
+
+    objects, refs = [], iter(ring_arcs)
+    for feature in geojson["features"]:
+        polygons = [[next(refs) for _ in polygon] for polygon in _polygons(feature["geometry"])]
+        objects.append({"properties": feature["properties"], "polygons": polygons})
+    return arcs, objects
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Indices of the points kept when simplifying a line at ``tolerance``.
+    """
+    points = np.asarray(points, dtype=float)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        segment = end - start
+        length = math.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(*(inner - start).T)
+        else:
+            offsets = inner - start
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            middle = first + 1 + i
+            keep[middle] = True
+            stack += [(first, middle), (middle, last)]
+    return np.flatnonzero(keep)
+
+
+def _ring_length(arcs, refs):
+    # Number of points of a ring made of arcs (the closing point included)
+    return 1 + sum(len(arcs[ref if ref >= 0 else ~ref]) - 1 for ref in refs)
+
+
+def encode(arcs, objects, tolerance):
+    """
+    Simplify the arcs and encode them as a delta-encoded TopoJSON object.
+    """
+    simplified = [np.asarray(arc)[douglas_peucker(arc, tolerance * SCALE)] for arc in arcs]
+    # A département whose every polygon collapses keeps its full outline
+    for obj in objects:
+        exteriors = [polygon[0] for polygon in obj["polygons"]]
+        if all(_ring_length(simplified, refs) < 4 for refs in exteriors):
+            for ref in (ref for refs in exteriors for ref in refs):
+                i = ref if ref >= 0 else ~ref
+                simplified[i] = np.asarray(arcs[i])
+    encoded = [np.diff(arc, axis=0, prepend=[[0, 0]]).tolist() for arc in simplified]
+    geometries = []
+    for obj in objects:
+        geometries.append({
+            "type": "MultiPolygon",
+            "properties": obj["properties"],
+            "arcs": obj["polygons"],
+        })
+    return {
+        "type": "Topology",
+        "transform": {"scale": [1 / SCALE, 1 / SCALE], "translate": [0, 0]},
+        "objects": {"departements": {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": encoded,
+    }
+
+
+def decode(topology):
+    """
+    Convert an encoded topology back to a GeoJSON feature collection.
+    Rings collapsed by the simplification are dropped.
+    """
+    arcs = [np.cumsum(np.asarray(arc, dtype=np.int64), axis=0) for arc in topology["arcs"]]
+
+    def ring_points(refs):
+        ring = []
+        for ref in refs:
+            arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+            ring.extend(arc[1:] if ring else arc)
+        return [[x / SCALE, y / SCALE] for x, y in ring]
+
+    features = []
+    for geometry in topology["objects"]["departements"]["geometries"]:
+        polygons = []
+        for polygon in geometry["arcs"]:
+            # A ring needs at least three distinct points
+            rings = [ring_points(refs) for refs in polygon]
+            if len(rings[0]) >= 4:
+                polygons.append([ring for ring in rings if len(ring) >= 4])
+        features.append({
+            "type": "Feature",
+            "properties": geometry["properties"],
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def variant_path(tolerance, geo_dir=GEO_DIR):
+    return Path(geo_dir) / f"departements-{tolerance:g}.topojson.gz"
+
+
+def build_variants(source=GEOJSON_PATH, geo_dir=GEO_DIR, tolerances=TOLERANCES):
+    """
+    Write one encoded topology per tolerance, tagged with the fingerprint of
+    the source GeoJSON.
+    """
+    with open(source, "r", encoding="utf-8") as f:
+        geojson = json.load(f)
+    arcs, objects = build_topology(geojson)
+    Path(geo_dir).mkdir(parents=True, exist_ok=True)
+    for tolerance in tolerances:
+        topology = encode(arcs, objects, tolerance)
+        topology["source"] = fingerprint(source)
+        path = variant_path(tolerance, geo_dir)
+        # Written aside and renamed, so that other sessions never read a partial file
+        handle, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=geo_dir)
+        with os.fdopen(handle, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            json.dump(topology, f, separators=(",", ":"), ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+def load_variant(tolerance, source=GEOJSON_PATH, geo_dir=GEO_DIR):
+    """
+    GeoJSON of the départements simplified at ``tolerance``, building the
+    variants first if they are missing or older than the source.
+    """
+    path = variant_path(tolerance, geo_dir)
+    topology = None
+    if path.exists():
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            topology = json.load(f)
+    if topology is None or topology.get("source") != fingerprint(source):
+        build_variants(source, geo_dir)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            topology = json.load(f)
+    return decode(topology)
+
+
+def tolerance_for_zoom(zoom, tolerances=TOLERANCES):
+    """
+    Coarsest tolerance below half a pixel at a web-mercator zoom level.
+    """
+    half_pixel = 360 / (256 * 2 ** zoom) / 2
+    fitting = [t for t in tolerances if t <= half_pixel]
+    return max(fitting) if fitting else min(tolerances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the simplified département boundaries.")
+    parser.add_argument("--source", default=GEOJSON_PATH, type=Path)
+    parser.add_argument("--geo-dir", default=GEO_DIR, type=Path)
+    args = parser.parse_args()
+    build_variants(args.source, args.geo_dir)
+    for tolerance in TOLERANCES:
+        path = variant_path(tolerance, args.geo_dir)
+        geojson = json.dumps(load_variant(tolerance, args.source, args.geo_dir), separators=(",", ":"))
+        print(f"{tolerance:g}: {path.stat().st_size / 1e3:8.1f} kB on disk, "
+              f"{len(geojson) / 1e3:8.1f} kB as GeoJSON")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Lightweight timing and memory instrumentation of the data stages.
+
+``stage`` wraps a step (csv parsing, dedup, aggregation, geojson loading,
+chart serialization...) and records its elapsed time, the rows it got and
+returned and the change of resident memory of the process. Cache calls
+and misses and the sizes of the chart payloads are counted as well.
+
+Records are kept in memory, the last ``MAX_RECORDS`` of the process; the
+debug panel of the pages (``dpe.debug``) shows them and exports them as
+JSON or CSV. Nothing here depends on Streamlit, so the backends record
+their stages when used from the command line too.
+"""
+import functools
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Records kept per process
+MAX_RECORDS = 2000
+
+_records = deque(maxlen=MAX_RECORDS)
+_cache_calls = Counter()
+_cache_misses = Counter()
+_lock = threading.Lock()
+_context = threading.local()
+
+
+def resident_memory():
+    """
+    Resident memory of the process in MB, None where /proc is missing.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        return None
+
+
+def set_context(**fields):
+    """
+    Fields (page, session...) added to the records of the current thread.
+    """
+    _context.fields = {**getattr(_context, "fields", {}), **fields}
+
+
+def context():
+    """
+    Fields of the records of the current thread.
+    """
+    return dict(getattr(_context, "fields", {}))
+
+
+def _rows(value):
+    return None if value is None else int(value)
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Record the time and memory of the block. Set ``rows_out`` (and
+    ``rows_in`` if not given) on the yielded record::
+
+        with stage("clean", rows_in=len(dpe_data)) as record:
+            dpe_data = clean(dpe_data)
+            record["rows_out"] = len(dpe_data)
+    """
+    record = {**context(), "stage": name, "rows_in": rows_in, "rows_out": None}
+    memory = resident_memory()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 6)
+        after = resident_memory()
+        record["memory_mb"] = None if memory is None else round(after - memory, 2)
+        record["rows_in"] = _rows(record["rows_in"])
+        record["rows_out"] = _rows(record["rows_out"])
+        record["time"] = time.time()
+        with _lock:
+            _records.append(record)
+
+
+def record_payload(name, size):
+    """
+    Record the size in bytes of a payload sent to the browser.
+    """
+    record = {**context(), "stage": f"payload:{name}", "bytes": int(size), "time": time.time()}
+    with _lock:
+        _records.append(record)
+
+
+def counted_cache(cache, **options):
+    """
+    Apply a Streamlit cache decorator (``st.cache_data`` or
+    ``st.cache_resource``) and count the calls and the misses (the runs of
+    the function itself) of the cached function.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def compute(*args, **kwargs):
+            with _lock:
+                _cache_misses[name] += 1
+            return func(*args, **kwargs)
+
+        cached = cache(**options)(compute)
+
+        @functools.wraps(func)
+        def call(*args, **kwargs):
+            with _lock:
+                _cache_calls[name] += 1
+            return cached(*args, **kwargs)
+
+        call.clear = cached.clear
+        return call
+    return decorator
+
+
+def cache_stats():
+    """
+    Calls, hits and misses of the counted caches, by function name.
+    """
+    with _lock:
+        return {
+            name: {"calls": calls, "hits": calls - _cache_misses[name], "misses": _cache_misses[name]}
+            for name, calls in _cache_calls.items()
+        }
+
+
+def records(**fields):
+    """
+    Copy of the records, optionally only those matching ``fields``.
+    """
+    with _lock:
+        found = list(_records)
+    return [record for record in found if all(record.get(key) == value for key, value in fields.items())]
+
+
+def clear():
+    with _lock:
+        _records.clear()
+        _cache_calls.clear()
+        _cache_misses.clear()
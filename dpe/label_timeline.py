@@ -0,0 +1,84 @@
+"""
+Label counts per département over any range of months.
+
+The label cube (counts per département, month, DPE and GES label, see
+``dpe.cubes.label_cube``) is turned once into an array of cumulative
+counts per département, month and label, starting from zero. The counts
+of the months ``[first, last]`` are then the difference of two rows of
+that array, nationwide or for one département, instead of a new pass over
+the cube or the rows for every window.
+"""
+import numpy as np
+import pandas as pd
+
+from dpe.cubes import DEPARTEMENT, LABEL_KINDS, LABELS, MONTH, label_table
+
+
+class LabelTimeline:
+    """
+    Cumulative DPE and GES label counts per département by month of a
+    label cube (a ``count`` series indexed by département, month and
+    labels).
+    """
+
+    def __init__(self, cube):
+        cube = cube[cube.index.get_level_values(MONTH).notna()]
+        # Départements in the order of ``label_table``, missing one included
+        self.departements = label_table(cube).index.tolist()
+        self.months = pd.DatetimeIndex(sorted(cube.index.get_level_values(MONTH).unique()))
+        self._index = pd.Index(self.departements, dtype=object)
+        departements = self._index.get_indexer(cube.index.get_level_values(DEPARTEMENT).astype(object))
+        months = self.months.get_indexer(cube.index.get_level_values(MONTH)) + 1
+        counts = np.zeros((len(self.departements), len(self.months) + 1, len(LABEL_KINDS) * len(LABELS)))
+        values = cube.to_numpy(dtype=float)
+        for k, kind in enumerate(LABEL_KINDS):
+            labels = pd.Index(LABELS).get_indexer(cube.index.get_level_values(kind))
+            known = labels >= 0
+            np.add.at(counts, (departements[known], months[known], k * len(LABELS) + labels[known]), values[known])
+        # Counts up to (and including) each month, after a row of zeros
+        self.cumulative = counts.cumsum(axis=1)
+        self.national = self.cumulative.sum(axis=0)
+
+    def month_range(self):
+        """
+        First and last month with DPE.
+        """
+        return self.months[0], self.months[-1]
+
+    def _bounds(self, first, last):
+        # Rows of the cumulative counts before ``first`` and at ``last``
+        first = self.months[0] if first is None else pd.Timestamp(first).to_period("M").to_timestamp()
+        last = self.months[-1] if last is None else pd.Timestamp(last).to_period("M").to_timestamp()
+        return self.months.searchsorted(first, side="left"), self.months.searchsorted(last, side="right")
+
+    def _frame(self, counts):
+        return pd.DataFrame({
+            "Etiquette": LABELS,
+            **{kind: counts[k * len(LABELS):(k + 1) * len(LABELS)] for k, kind in enumerate(LABEL_KINDS)},
+        })
+
+    def counts(self, first=None, last=None, departement=None):
+        """
+        Counts of each label of the DPE issued from the month ``first`` to
+        the month ``last`` (the whole range for None), for a département
+        or nationwide (None), as the frame of the butterfly chart:
+        Etiquette, Etiquette_DPE, Etiquette_GES.
+        """
+        low, high = self._bounds(first, last)
+        if departement is None:
+            cumulative = self.national
+        else:
+            row = self._index.get_indexer([departement])[0]
+            if row < 0:
+                return self._frame(np.zeros(len(LABEL_KINDS) * len(LABELS)))
+            cumulative = self.cumulative[row]
+        return self._frame(cumulative[high] - cumulative[low])
+
+    def average(self, first=None, last=None):
+        """
+        Average count of each label per département over the months, as
+        ``counts``.
+        """
+        counts = self.counts(first, last)
+        counts[LABEL_KINDS] = counts[LABEL_KINDS] / len(self.departements)
+        return counts
@@ -0,0 +1,41 @@
+"""
+Precompute the tables of the pages ahead of time (see dpe/artifacts.py).
+
+    python -m dpe.precompute --data-dir data
+
+The app then starts from these tables (``DPE_BACKEND=auto``, the default)
+without loading the raw data.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from dpe.artifacts import write_artifacts
+from dpe.backends import PandasBackend
+from dpe.config import DATA_DIR, INGEST, STORE_DIR
+
+
+def precompute(data_dir=DATA_DIR, store_dir=STORE_DIR, ingest=INGEST, keep=2):
+    """
+    Run the pipeline on the shards and write its tables, return the manifest.
+    """
+    backend = PandasBackend.from_store(data_dir, store_dir, ingest)
+    return write_artifacts(backend.aggregates(), backend.filter_options(), backend.dpe_data,
+                           data_dir=data_dir, store_dir=store_dir, keep=keep)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the tables of the DPE pages.")
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--store-dir", default=STORE_DIR, type=Path)
+    parser.add_argument("--ingest", default=INGEST, choices=["store", "stream"])
+    parser.add_argument("--keep", default=2, type=int, help="number of versions kept")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    manifest = precompute(args.data_dir, args.store_dir, args.ingest, args.keep)
+    print(f"{manifest['name']}: {len(manifest['tables'])} tables, {manifest['bytes'] / 1e6:.1f} MB "
+          f"in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
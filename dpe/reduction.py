@@ -0,0 +1,88 @@
+"""
+Server-side reduction of the chart data to a point budget.
+
+Altair embeds the whole DataFrame of a chart in its Vega-Lite spec and
+Plotly its whole traces, so what is sent to the browser grows with the
+data. The helpers below shrink the data before it is handed to
+``st.altair_chart``/``st.plotly_chart``, so that specs stay bounded:
+
+- ``chart_columns`` keeps only the columns the encodings use,
+- ``downsample_lines`` bins the x axis of line series to the budget.
+
+With the DPE_VEGAFUSION setting (and the optional vegafusion package)
+the Vega transforms of the Altair charts are evaluated on the server too.
+"""
+import logging
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+from dpe.config import POINT_BUDGET, VEGAFUSION
+
+logger = logging.getLogger(__name__)
+
+
+def chart_columns(frame, columns):
+    """
+    The columns of ``frame`` encoded by a chart, in that order.
+    """
+    return frame[list(dict.fromkeys(columns))]
+
+
+def _bin_edges(values, bins):
+    # Evenly spaced edges over the range of ``values`` (numbers or dates)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        numbers = values.astype("int64")
+        return np.linspace(numbers.min(), numbers.max(), bins + 1), numbers
+    numbers = values.astype("float64")
+    return np.linspace(numbers.min(), numbers.max(), bins + 1), numbers
+
+
+def downsample_lines(frame, x, y, by=None, weight=None, budget=POINT_BUDGET):
+    """
+    At most ``budget`` points over all the series of a line chart.
+
+    The series (one per value of ``by``) keeping more than their share of
+    the budget are cut into equal bins of ``x``; each bin becomes a point
+    at its first ``x`` with the mean of every ``y`` column, weighted by
+    ``weight`` (summed) when given. Smaller frames are returned as they are.
+    """
+    y = [y] if isinstance(y, str) else list(y)
+    series = [frame] if by is None else [group for _, group in frame.groupby(by, sort=False, observed=True)]
+    if len(frame) <= budget or not series:
+        return frame
+    share = max(budget // len(series), 2)
+    reduced = []
+    for group in series:
+        if len(group) <= share:
+            reduced.append(group)
+            continue
+        group = group.sort_values(x)
+        edges, numbers = _bin_edges(group[x], share)
+        bins = np.clip(np.searchsorted(edges, numbers, side="right") - 1, 0, share - 1)
+        weights = group[weight].astype("float64") if weight else pd.Series(1.0, index=group.index)
+        known = group[y].notna()
+        sums = group[y].mul(weights, axis=0).groupby(bins).sum(min_count=1)
+        totals = known.mul(weights, axis=0).groupby(bins).sum()
+        points = group.groupby(bins).first()
+        points[y] = sums / totals.where(totals > 0)
+        if weight:
+            points[weight] = weights.groupby(bins).sum()
+        reduced.append(points.reset_index(drop=True))
+    return pd.concat(reduced, ignore_index=True)
+
+
+def enable_server_transforms():
+    """
+    Evaluate the Vega transforms of the Altair charts on the server when
+    the DPE_VEGAFUSION setting is on and vegafusion is installed.
+    """
+    if not VEGAFUSION or alt.data_transformers.active == "vegafusion":
+        return
+    try:
+        import vegafusion  # noqa: F401
+    except ImportError:
+        logger.warning("DPE_VEGAFUSION is set but vegafusion is not installed: pip install vegafusion vl-convert-python")
+        return
+    alt.data_transformers.enable("vegafusion")
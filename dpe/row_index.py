@@ -0,0 +1,152 @@
+"""
+Index of the rows by (departement, DPE label, date) for the drill-down page.
+
+The rows are ordered once by departement, DPE label, date and address
+(the address settles ties, a cleaned dataset having one DPE per address).
+In that order the rows of a (departement, label) pair are contiguous and
+sorted by date, so a filter state is a few binary searches per selected
+pair instead of a scan of the dataset. Sorting by another column is an
+argsort of the selected rows only, memoized per filter state and sort.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from dpe.address_index import ADDRESS
+from dpe.cubes import DEPARTEMENT
+from dpe.filters import ETIQUETTE, TYPE, filter_key
+from dpe.schema import DATE_COLUMN
+
+# Order of the rows in the index
+ORDER_COLUMNS = [DEPARTEMENT, ETIQUETTE, DATE_COLUMN, ADDRESS]
+
+# Columns the index is built from
+INDEX_COLUMNS = ORDER_COLUMNS + [TYPE]
+
+
+def ranks(column):
+    """
+    Rank of the values of ``column`` among its sorted distinct values
+    (missing values ranked last) and those values.
+    """
+    column = pd.Series(column)
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # Rank the categories rather than their codes, which need not be sorted
+        categories = np.asarray(column.cat.categories, dtype=object)
+        order = np.argsort(categories)
+        rank = np.empty(len(order) + 1, dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        rank[-1] = len(order)
+        return rank[column.cat.codes.to_numpy()], categories[order].tolist()
+    codes, uniques = pd.factorize(column, sort=True, use_na_sentinel=True)
+    codes = codes.astype(np.int64)
+    codes[codes < 0] = len(uniques)
+    return codes, list(uniques)
+
+
+class RowIndex:
+    """
+    Row positions of a dataset by departement, DPE label, year range and
+    building type, ordered by any of its columns.
+
+    ``keys`` holds the ``INDEX_COLUMNS`` of the rows; ``load_column`` gives
+    the whole column of a name when the rows are sorted by it.
+    """
+
+    def __init__(self, keys, load_column, max_entries=32):
+        self.load_column = load_column
+        departements, self.departements = ranks(keys[DEPARTEMENT])
+        labels, self.categories = ranks(keys[ETIQUETTE])
+        types, self.building_types = ranks(keys[TYPE])
+        addresses, _ = ranks(keys[ADDRESS])
+        dates = keys[DATE_COLUMN].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        self.order = np.lexsort((addresses, dates, labels, departements))
+        # Sorted (departement, label) keys and dates, in index order
+        self.pairs = (departements * (len(self.categories) + 1) + labels)[self.order]
+        self.dates = dates[self.order]
+        self.types = types[self.order]
+        self.max_entries = max_entries
+        self._ranks = {}
+        self._cache = OrderedDict()
+        # The index is shared by the sessions, which run in threads
+        self._lock = threading.Lock()
+
+    def _codes(self, values, selected):
+        # Codes of the selected values (missing ones last), every value and
+        # missing ones for None
+        if selected is None:
+            return range(len(values) + 1)
+        code = {value: i for i, value in enumerate(values)}
+        codes = {len(values) if pd.isna(value) else code.get(value) for value in selected}
+        return sorted(codes - {None})
+
+    def _select(self, year_range, building_types, categories, departements):
+        # Positions in index order of the rows matching the filters
+        (first, last), building_types, categories = filter_key(year_range, building_types, categories)
+        start = pd.Timestamp(year=first, month=1, day=1).value
+        end = pd.Timestamp(year=last + 1, month=1, day=1).value
+        ranges = []
+        for departement in self._codes(self.departements, departements):
+            for label in self._codes(self.categories, categories):
+                pair = departement * (len(self.categories) + 1) + label
+                low, high = np.searchsorted(self.pairs, [pair, pair + 1])
+                low, high = low + np.searchsorted(self.dates[low:high], [start, end])
+                if high > low:
+                    ranges.append(np.arange(low, high))
+        selected = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+        allowed = np.zeros(len(self.building_types) + 1, dtype=bool)
+        allowed[self._codes(self.building_types, building_types)] = True
+        return selected[allowed[self.types[selected]]]
+
+    def _column_ranks(self, column):
+        with self._lock:
+            if column in self._ranks:
+                return self._ranks[column]
+        column_ranks = ranks(self.load_column(column))
+        with self._lock:
+            self._ranks[column] = column_ranks
+        return column_ranks
+
+    def select(self, year_range, building_types, categories=None, departements=None,
+               sort_by=None, ascending=True):
+        """
+        Positions of the rows matching the filters, in index order or
+        sorted by the ``sort_by`` column (missing values last, ties in
+        index order); ``None`` keeps every label or departement and a
+        missing value among the selected ones keeps the rows without one.
+        """
+        key = (
+            filter_key(year_range, building_types, categories),
+            None if departements is None else tuple(self._codes(self.departements, departements)),
+            sort_by,
+            bool(ascending),
+        )
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        selected = self._select(year_range, building_types, categories, departements)
+        if sort_by is not None:
+            column_ranks, distinct = self._column_ranks(sort_by)
+            values = column_ranks[self.order[selected]]
+            if not ascending:
+                n_values = len(distinct)
+                values = np.where(values < n_values, n_values - 1 - values, values)
+            selected = selected[np.argsort(values, kind="stable")]
+        positions = self.order[selected]
+        positions.flags.writeable = False
+        with self._lock:
+            self._cache[key] = positions
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return positions
+
+    def page(self, page, page_size, *args, **kwargs):
+        """
+        Row positions of the page ``page`` (from 0) of ``page_size`` rows of
+        a selection (arguments of ``select``) and the size of the selection.
+        """
+        positions = self.select(*args, **kwargs)
+        return positions[page * page_size:(page + 1) * page_size], len(positions)
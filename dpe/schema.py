@@ -0,0 +1,73 @@
+"""
+Columns of the ADEME dataset used by the app and their types.
+"""
+import pyarrow as pa
+
+SHARD_GLOB = "dpe-v2-logements-neufs-*.csv"
+
+DATE_COLUMN = "Date_établissement_DPE"
+
+# Repeated labels, stored as categoricals
+CATEGORICAL_COLUMNS = [
+    "Type_bâtiment",
+    "Etiquette_DPE",
+    "Etiquette_GES",
+    "Modèle_DPE",
+    "N°_département_(BAN)",
+]
+
+# Free text identifiers
+STRING_COLUMNS = [
+    "Adresse_(BAN)",
+    "N°DPE",
+]
+
+NUMERIC_COLUMNS = [
+    "Surface_habitable_logement",
+    "Emission_GES_5_usages_par_m²",
+    "Conso_chauffage_é_finale",
+    "Conso_éclairage_é_finale",
+    "Conso_ECS_é_finale",
+    "Conso_refroidissement_é_finale",
+    "Conso_auxiliaires_é_finale",
+    "Coût_chauffage",
+    "Coût_éclairage",
+    "Coût_ECS",
+    "Coût_refroidissement",
+]
+
+# Every column read by the pages
+COLUMNS = STRING_COLUMNS + CATEGORICAL_COLUMNS + [DATE_COLUMN] + NUMERIC_COLUMNS
+
+# Flag of the GHG emissions out of the range of the others, added by the
+# cleaning (see dpe/cleaning.py)
+GHG_OUTLIER = "Emission_GES_outlier"
+
+DTYPES = {
+    **{col: "category" for col in CATEGORICAL_COLUMNS},
+    **{col: "string" for col in STRING_COLUMNS},
+    **{col: "float64" for col in NUMERIC_COLUMNS},
+}
+
+# Types given to the arrow csv reader. The DPE date is read as text and
+# parsed afterwards so that malformed dates become null instead of failing.
+ARROW_TYPES = {
+    **{col: pa.dictionary(pa.int32(), pa.string()) for col in CATEGORICAL_COLUMNS},
+    **{col: pa.string() for col in STRING_COLUMNS},
+    **{col: pa.float64() for col in NUMERIC_COLUMNS},
+    DATE_COLUMN: pa.string(),
+}
+
+DATE_FORMAT = "%Y-%m-%d"
+
+# Columns of the address cart and of the consumption / cost comparison
+CART_ADRESS = ["Adresse_(BAN)", "Type_bâtiment",
+               "Surface_habitable_logement", "Etiquette_GES",
+               "N°DPE", "Etiquette_DPE", "Modèle_DPE",
+               DATE_COLUMN]
+CHART_CONSO = ["Conso_chauffage_é_finale", "Conso_éclairage_é_finale",
+               "Conso_ECS_é_finale",
+               "Conso_refroidissement_é_finale",
+               "Conso_auxiliaires_é_finale"]
+CHART_COUT = ["Coût_chauffage", "Coût_éclairage", "Coût_ECS",
+              "Coût_refroidissement"]
@@ -0,0 +1,84 @@
+"""
+Heavy sections of the pages, computed concurrently.
+
+A page adds each heavy section (query, chart building) with a placeholder,
+a ``compute`` function run in a thread pool shared by the sessions and a
+``render`` function called with its result. The text of the page is
+written meanwhile, and the placeholders are filled in the order the
+results come, so a page waits for its slowest section rather than for the
+sum of them. Only ``render`` writes to the page, from the script thread.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from dpe.config import SECTION_WORKERS
+from dpe.instrument import context, set_context, stage
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor():
+    """
+    Thread pool of the sections, created once per process.
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SECTION_WORKERS, thread_name_prefix="dpe-section")
+        return _executor
+
+
+class Sections:
+    """
+    Sections of one run of a page script.
+    """
+
+    def __init__(self):
+        # Streamlit context and instrumentation fields of the script run,
+        # given to the worker threads
+        self._ctx = get_script_run_ctx()
+        self._fields = context()
+        self._pending = {}
+
+    def _run(self, name, compute):
+        thread = threading.current_thread()
+        add_script_run_ctx(thread, self._ctx)
+        set_context(**self._fields)
+        try:
+            with stage(f"section:{name}"):
+                return compute()
+        finally:
+            add_script_run_ctx(thread, None)
+
+    def reserve(self, message="Loading..."):
+        """
+        Placeholder here for a section added later, once its inputs (such
+        as widgets) are known.
+        """
+        placeholder = st.empty()
+        placeholder.caption(f"⏳ {message}")
+        return placeholder
+
+    def add(self, name, compute, render, message="Loading...", placeholder=None):
+        """
+        Start ``compute()`` in the background and keep a placeholder here
+        (or the reserved ``placeholder``) for ``render(result)``.
+        """
+        if placeholder is None:
+            placeholder = self.reserve(message)
+        future = executor().submit(self._run, name, compute)
+        self._pending[future] = (placeholder, render)
+
+    def render(self):
+        """
+        Fill the placeholders as the sections complete.
+        """
+        for future in as_completed(self._pending):
+            placeholder, render = self._pending[future]
+            with placeholder.container():
+                render(future.result())
+        self._pending = {}
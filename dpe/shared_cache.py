@@ -0,0 +1,248 @@
+"""
+Cache of the dataset and its aggregates shared by the worker processes.
+
+``st.cache_resource`` keeps one copy per process, built by the first
+session of every worker. Here the cleaned dataset and the aggregate tables
+are also written once as Arrow IPC files in a cache folder, keyed by the
+fingerprints of the shards, and every process memory-maps them: the pages
+of the files are shared by the processes through the page cache, and the
+numeric columns are used in place without a copy (they are read-only).
+
+The folder is kept under ``max_bytes``, the least recently used entries
+being removed first. ``python -m dpe.shared_cache`` fills it ahead of
+time, e.g. at deploy, so that the first session does not load the shards:
+
+    python -m dpe.shared_cache && streamlit run General_Presentation.py
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from dpe.aggregates import compute_aggregates, plain_keys
+from dpe.artifacts import source_fingerprints
+from dpe.cleaning import clean, write_quality_report
+from dpe.compaction import compact
+from dpe.config import CACHE_DIR, CACHE_MAX_MB, DATA_DIR, INGEST, STORE_DIR
+from dpe.instrument import stage
+from dpe.store import load_store
+from dpe.streaming import load_stream
+
+logger = logging.getLogger(__name__)
+
+# Bump when the cached tables change
+CACHE_VERSION = 3
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _to_arrow(frame):
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    # Keep NaN as NaN rather than null, so that float columns without nulls
+    # are handed back to pandas without a copy
+    for i, col in enumerate(table.column_names):
+        if pd.api.types.is_float_dtype(frame[col].dtype):
+            values = pa.array(frame[col].to_numpy(), type=table.schema.field(i).type)
+            table = table.set_column(i, table.schema.field(i), values)
+    return table
+
+
+def _write_table(frame, path):
+    table = _to_arrow(frame)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_table(path):
+    with pa.memory_map(str(path), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    # One block per column: numeric columns stay views of the mapped file
+    return table.to_pandas(split_blocks=True)
+
+
+def _size(path):
+    return sum(file.stat().st_size for file in path.iterdir())
+
+
+class SharedCache:
+    """
+    Tables stored as Arrow IPC files in ``directory``, one folder per
+    entry, at most ``max_bytes`` in total (0 disables the cache).
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1_000_000):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def _entry(self, name, key):
+        return self.directory / f"{name}-{key}"
+
+    def get(self, name, key):
+        """
+        Tables and metadata of an entry, None if not cached.
+        """
+        entry = self._entry(name, key)
+        try:
+            with open(entry / MANIFEST_NAME, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            # The modification time of the folder orders the entries by last use
+            os.utime(entry)
+            tables = {table: _read_table(entry / f"{table}.arrow") for table in manifest["tables"]}
+        except (OSError, ValueError, pa.ArrowInvalid):
+            # Missing, or removed by another process meanwhile
+            return None
+        return tables, manifest["metadata"]
+
+    def put(self, name, key, tables, metadata=None):
+        """
+        Store the frames ``tables`` (by name) and the JSON ``metadata`` of
+        an entry, then remove the least recently used entries over size.
+        """
+        if not self.max_bytes:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so that other processes never read a partial entry
+        tmp = Path(tempfile.mkdtemp(prefix=f".{name}-", dir=self.directory))
+        for table, frame in tables.items():
+            _write_table(frame, tmp / f"{table}.arrow")
+        with open(tmp / MANIFEST_NAME, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "tables": list(tables), "metadata": metadata or {}}, f)
+        entry = self._entry(name, key)
+        try:
+            tmp.rename(entry)
+        except OSError:
+            # Already stored by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=entry)
+
+    def get_or_build(self, name, key, build):
+        """
+        Cached tables and metadata of an entry, else those returned by
+        ``build()`` once stored.
+        """
+        with stage(f"shared_cache:{name}") as record:
+            found = self.get(name, key)
+            record["hit"] = found is not None
+        if found is not None:
+            return found
+        tables, metadata = build()
+        self.put(name, key, tables, metadata)
+        # Read back so that every process uses the mapped files
+        return self.get(name, key) or (tables, metadata)
+
+    def entries(self):
+        """
+        Entry folders, from the least to the most recently used.
+        """
+        if not self.directory.exists():
+            return []
+        found = [path for path in self.directory.iterdir() if path.is_dir() and not path.name.startswith(".")]
+        return sorted(found, key=lambda path: path.stat().st_mtime)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until under ``max_bytes``.
+        """
+        entries = self.entries()
+        total = sum(_size(entry) for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            size = _size(entry)
+            # Processes having mapped the files keep reading them once removed
+            shutil.rmtree(entry, ignore_errors=True)
+            if not entry.exists():
+                total -= size
+                logger.info("Evicted %s from the shared cache (%.1f MB)", entry.name, size / 1e6)
+
+
+def source_key(data_dir=DATA_DIR, ingest=INGEST):
+    """
+    Key of the tables computed from the shards of ``data_dir``.
+    """
+    sources = {"version": CACHE_VERSION, "ingest": ingest, "shards": source_fingerprints(data_dir)}
+    return hashlib.sha1(json.dumps(sources, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_dataset(data_dir=DATA_DIR, store_dir=STORE_DIR, ingest=INGEST):
+    """
+    Deduplicated, cleaned and compacted dataset and the reports of the
+    cleaning (also written to ``<store>/quality.json``) and compaction.
+    """
+    with stage("load") as record:
+        dpe_data = load_stream(data_dir=data_dir, store_dir=store_dir) if ingest == "stream" \
+            else load_store(data_dir=data_dir, store_dir=store_dir)
+        record["rows_out"] = len(dpe_data)
+    if ingest != "stream":
+        with stage("clean", rows_in=len(dpe_data)) as record:
+            dpe_data = clean(dpe_data)
+            record["rows_out"] = len(dpe_data)
+    quality = dpe_data.attrs.get("quality")
+    write_quality_report(quality, store_dir)
+    with stage("compact", rows_in=len(dpe_data)) as record:
+        dpe_data, compaction = compact(dpe_data)
+        record["rows_out"] = len(dpe_data)
+    return dpe_data, {"quality": quality, "compaction": compaction}
+
+
+def cached_dataset(data_dir=DATA_DIR, store_dir=STORE_DIR, ingest=INGEST, cache=None):
+    """
+    ``load_dataset`` through the shared cache, the reports of the cleaning
+    and compaction in ``attrs["quality"]`` and ``attrs["compaction"]``.
+    """
+    cache = cache or SharedCache()
+
+    def build():
+        dpe_data, reports = load_dataset(data_dir, store_dir, ingest)
+        return {"rows": dpe_data}, reports
+
+    tables, reports = cache.get_or_build("dataset", source_key(data_dir, ingest), build)
+    dpe_data = tables["rows"]
+    dpe_data.attrs.update(reports)
+    return dpe_data
+
+
+def cached_aggregates(dpe_data, data_dir=DATA_DIR, ingest=INGEST, cache=None):
+    """
+    Aggregate tables of the dataset ``dpe_data`` (of the shards of
+    ``data_dir``) through the shared cache.
+    """
+    cache = cache or SharedCache()
+
+    def build():
+        with stage("aggregates", rows_in=len(dpe_data)):
+            return compute_aggregates(dpe_data), None
+
+    tables, _ = cache.get_or_build("aggregates", source_key(data_dir, ingest), build)
+    return plain_keys(tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the shared cache of the dataset and its aggregates.")
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--store-dir", default=STORE_DIR, type=Path)
+    parser.add_argument("--ingest", default=INGEST, choices=["store", "stream"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    cache = SharedCache()
+    dpe_data = cached_dataset(args.data_dir, args.store_dir, args.ingest, cache)
+    if args.ingest != "stream":
+        # The streaming ingestion writes its own aggregates
+        cached_aggregates(dpe_data, args.data_dir, args.ingest, cache)
+    for entry in cache.entries():
+        logger.info("%s: %.1f MB", entry.name, _size(entry) / 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Monthly surface-weighted CO₂ statistics of the "Global Trends" chart.
+
+The statistics are derived from grouped sums (of w, w·x and w·x², with w
+the habitable surface and x the emissions per m²), computed in one
+vectorized groupby. Sums of several groups add up, so the overall series
+is obtained from the per-type sums without a second scan of the rows.
+
+Anomalous months of a series are then found with a rolling median and
+median absolute deviation (a Hampel filter) and, with the
+DPE_TREND_CORRECTION setting, replaced by the rolling median.
+"""
+import numpy as np
+import pandas as pd
+
+from dpe.config import TREND_CORRECTION
+from dpe.schema import DATE_COLUMN
+
+WEIGHT = "Surface_habitable_logement"
+VALUE = "Emission_GES_5_usages_par_m²"
+TYPE = "Type_bâtiment"
+
+SUM_COLUMNS = ["n", "sw", "sw_x", "swx", "swx2"]
+
+# Months of the centered window of the anomaly detection, and the least
+# months of a window with a median
+ANOMALY_WINDOW = 11
+ANOMALY_MIN_MONTHS = 5
+# Robust z-score above which a month is anomalous. Months with few DPE
+# are noisy, a lower threshold flags some of them on clean series.
+ANOMALY_THRESHOLD = 5
+# Ratio of the standard deviation to the MAD of a normal distribution
+MAD_SCALE = 1.4826
+
+
+def weighted_stats(group):
+    """
+    Reference row-wise implementation, applied to each group with
+    ``groupby().apply``. Kept to check and benchmark the vectorized engine.
+    """
+    # Weighted average of CO₂ emissions
+    w = group[WEIGHT]
+    x = group[VALUE]
+    weighted_mean = (x * w).sum() / w.sum()
+    # Weighted variance (using weights as given)
+    weighted_var = ((w * (x - weighted_mean)**2).sum()) / w.sum()
+    # Standard error: sqrt(variance)/sqrt(n)
+    n = len(group)
+    error = np.sqrt(weighted_var) / np.sqrt(n) if n > 0 else 0
+    return pd.Series({
+        "avg_co2": weighted_mean,
+        "building_count": n,
+        "error": error,
+        "lower": weighted_mean - error,
+        "upper": weighted_mean + error
+    })
+
+
+def monthly_sums(dpe_data):
+    """
+    Sums per (month, building type) needed by the weighted statistics:
+
+    - n: number of DPE
+    - sw: sum of the weights
+    - sw_x: sum of the weights where the emissions are known
+    - swx, swx2: sums of w·x and w·x²
+
+    Rows without building type are kept (with a null type) so that they
+    still count in the overall series.
+    """
+    w = dpe_data[WEIGHT].astype("float64")
+    x = dpe_data[VALUE].astype("float64")
+    known = x.notna() & w.notna()
+    wx = (w * x).where(known)
+    terms = pd.DataFrame({
+        "month": dpe_data[DATE_COLUMN].dt.to_period("M").dt.to_timestamp(),
+        TYPE: dpe_data[TYPE],
+        "n": 1,
+        "sw": w,
+        "sw_x": w.where(known),
+        "swx": wx,
+        "swx2": wx * x,
+    })
+    return (
+        terms
+        .groupby(["month", TYPE], dropna=False, observed=True)[SUM_COLUMNS]
+        .sum()
+        .reset_index()
+        .dropna(subset=["month"])
+    )
+
+
+def stats_from_sums(sums):
+    """
+    Turn grouped sums into the statistics of ``weighted_stats``.
+    """
+    mean = sums["swx"] / sums["sw"]
+    # sum of w·(x - mean)² expanded over the sums, clipped against rounding
+    spread = (sums["swx2"] - 2 * mean * sums["swx"] + mean**2 * sums["sw_x"]).clip(lower=0)
+    error = np.sqrt(spread / sums["sw"]) / np.sqrt(sums["n"])
+    return pd.DataFrame({
+        "avg_co2": mean,
+        "building_count": sums["n"],
+        "error": error,
+        "lower": mean - error,
+        "upper": mean + error,
+    })
+
+
+def trend_from_sums(sums):
+    """
+    Per building type and overall monthly statistics from ``monthly_sums``.
+    """
+    per_type = sums.dropna(subset=[TYPE])
+    grouped_types = pd.concat(
+        [per_type[["month"]], per_type[TYPE].astype(object), stats_from_sums(per_type)],
+        axis=1,
+    )
+    overall = sums.groupby("month")[SUM_COLUMNS].sum().reset_index()
+    grouped_overall = pd.concat([overall[["month"]], stats_from_sums(overall)], axis=1)
+    grouped_overall[TYPE] = "Overall"
+    return pd.concat([grouped_types, grouped_overall], ignore_index=True)
+
+
+def monthly_trend(dpe_data):
+    """
+    Weighted monthly CO₂ statistics per building type, followed by the
+    overall series (``Type_bâtiment == "Overall"``).
+    """
+    return trend_from_sums(monthly_sums(dpe_data))
+
+
+def _rolling_median(values, by):
+    # Centered rolling median of every group of ``values``, in their order
+    rolling = values.groupby(by, sort=False).rolling(ANOMALY_WINDOW, center=True, min_periods=ANOMALY_MIN_MONTHS)
+    return rolling.median().droplevel(0).reindex(values.index)
+
+
+def flag_anomalies(trend, correct=TREND_CORRECTION):
+    """
+    Flag the months of every series of ``trend`` far from the median of the
+    months around them, in ``anomaly``, with that median in
+    ``trend_median`` and the value before any correction in
+    ``avg_co2_raw``. With ``correct``, ``avg_co2`` (and its bounds) of the
+    flagged months is replaced by the median.
+    """
+    trend = trend.copy()
+    ordered = trend.sort_values("month", kind="stable")
+    values = ordered["avg_co2"]
+    median = _rolling_median(values, ordered[TYPE])
+    deviation = (values - median).abs()
+    spread = MAD_SCALE * _rolling_median(deviation, ordered[TYPE])
+    # A month off a flat window (no spread) is anomalous too
+    score = (deviation / spread).where(deviation > 0, 0.0)
+    trend["trend_median"] = median
+    trend["anomaly"] = (score > ANOMALY_THRESHOLD).reindex(trend.index)
+    trend["avg_co2_raw"] = trend["avg_co2"]
+    if correct:
+        shift = (trend["trend_median"] - trend["avg_co2"]).where(trend["anomaly"], 0.0)
+        for col in ["avg_co2", "lower", "upper"]:
+            trend[col] = trend[col] + shift
+    return trend
@@ -0,0 +1,211 @@
+"""
+Columnar store of the dpe-v2-logements-neufs shards.
+
+Each csv shard is converted once to a typed, zstd compressed parquet part.
+A manifest keeps the fingerprint (size and mtime) of the shard every part
+was built from, so a part is only rebuilt when its shard changes. Loads then
+memory-map the parts and read only the requested columns.
+
+Run ``python -m dpe.store`` to do the conversion ahead of time.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+
+from dpe.config import DATA_DIR, STORE_DIR
+from dpe.schema import ARROW_TYPES, COLUMNS, DATE_COLUMN, DATE_FORMAT, SHARD_GLOB
+
+# Bump when the layout of the parts changes, to force a rebuild
+STORE_VERSION = 2
+
+MANIFEST_NAME = "manifest.json"
+
+
+def shard_paths(data_dir=DATA_DIR):
+    """
+    Return the csv shards of the data folder, in shard number order.
+    """
+    def shard_number(path):
+        match = re.search(r"(\d+)$", path.stem)
+        return int(match.group(1)) if match else 0
+    return sorted(Path(data_dir).glob(SHARD_GLOB), key=shard_number)
+
+
+def fingerprint(path, content=False):
+    """
+    Identify the version of a file from its size and modification time,
+    or from a hash of its content when ``content`` is True.
+    """
+    path = Path(path)
+    if content:
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    stat = path.stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def read_manifest(store_dir=STORE_DIR):
+    path = Path(store_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"version": STORE_VERSION, "parts": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != STORE_VERSION:
+        return {"version": STORE_VERSION, "parts": {}}
+    return manifest
+
+
+def write_manifest(manifest, store_dir=STORE_DIR):
+    path = Path(store_dir) / MANIFEST_NAME
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    tmp.replace(path)
+
+
+def convert_options():
+    """
+    Csv conversion of the app schema: only the used columns, fixed types.
+    """
+    # Empty fields are missing values, as with pd.read_csv
+    return pcsv.ConvertOptions(include_columns=COLUMNS, column_types=ARROW_TYPES, strings_can_be_null=True)
+
+
+def parse_dates(table):
+    """
+    Replace the DPE date column of an arrow table by parsed timestamps
+    (null when invalid).
+    """
+    dates = pc.strptime(table[DATE_COLUMN], format=DATE_FORMAT, unit="ns", error_is_null=True)
+    return table.set_column(table.schema.get_field_index(DATE_COLUMN), DATE_COLUMN, dates)
+
+
+def read_shard(path, use_threads=True):
+    """
+    Read one csv shard as an arrow table with the app schema and a DPE date
+    parsed at read time.
+    """
+    read_options = pcsv.ReadOptions(use_threads=use_threads)
+    return parse_dates(pcsv.read_csv(path, read_options=read_options, convert_options=convert_options()))
+
+
+def read_shards(paths, max_workers=None):
+    """
+    Read the shards concurrently and assemble them into a single frame.
+
+    The arrow tables are chained without copying and converted to pandas
+    once, so there is no intermediate ``pd.concat`` copy.
+    """
+    paths = list(paths)
+    if not paths:
+        return pd.DataFrame(columns=COLUMNS)
+    tables = _map_shards(lambda path: read_shard(path, use_threads=False), paths, max_workers)
+    return pa.concat_tables(tables).to_pandas()
+
+
+def _map_shards(func, paths, max_workers=None):
+    # The arrow csv reader releases the GIL, so threads are enough
+    max_workers = max_workers or min(len(paths), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(func, paths))
+
+
+def convert_shard(path, store_dir=STORE_DIR):
+    """
+    Convert a csv shard to a parquet part and return its number of rows.
+    """
+    table = read_shard(path, use_threads=False)
+    part = Path(store_dir) / f"{Path(path).stem}.parquet"
+    tmp = part.with_suffix(".tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    tmp.replace(part)
+    return table.num_rows
+
+
+def build_store(data_dir=DATA_DIR, store_dir=STORE_DIR, force=False, content=False):
+    """
+    Bring the store up to date with the csv shards and return the manifest.
+
+    Only the shards whose fingerprint changed since the last build are
+    converted again; parts of removed shards are deleted.
+    """
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {"version": STORE_VERSION, "parts": {}} if force else read_manifest(store_dir)
+    if manifest.get("content", False) != content:
+        manifest["parts"] = {}
+    paths = shard_paths(data_dir)
+    parts = {}
+    stale = []
+    for path in paths:
+        key = fingerprint(path, content=content)
+        known = manifest["parts"].get(path.name)
+        part_exists = (store_dir / f"{path.stem}.parquet").exists()
+        if known is None or known["fingerprint"] != key or not part_exists:
+            stale.append((path, key))
+        else:
+            parts[path.name] = known
+    if stale:
+        rows = _map_shards(lambda item: convert_shard(item[0], store_dir), stale)
+        for (path, key), n in zip(stale, rows):
+            parts[path.name] = {"fingerprint": key, "part": f"{path.stem}.parquet", "rows": n}
+    parts = {path.name: parts[path.name] for path in paths}
+    for name, entry in manifest["parts"].items():
+        if name not in parts:
+            (store_dir / entry["part"]).unlink(missing_ok=True)
+    manifest = {"version": STORE_VERSION, "content": content, "parts": parts}
+    write_manifest(manifest, store_dir)
+    return manifest
+
+
+def is_up_to_date(data_dir=DATA_DIR, store_dir=STORE_DIR):
+    manifest = read_manifest(store_dir)
+    content = manifest.get("content", False)
+    current = {path.name: fingerprint(path, content=content) for path in shard_paths(data_dir)}
+    known = {name: entry["fingerprint"] for name, entry in manifest["parts"].items()}
+    return bool(current) and current == known
+
+
+def load_store(columns=None, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Load the dataset from the parquet parts, building them first if the
+    shards changed. Only ``columns`` are read (all the schema by default).
+    """
+    if not is_up_to_date(data_dir, store_dir):
+        build_store(data_dir, store_dir)
+    manifest = read_manifest(store_dir)
+    paths = [str(Path(store_dir) / entry["part"]) for entry in manifest["parts"].values()]
+    if not paths:
+        return pd.DataFrame(columns=columns or COLUMNS)
+    table = pq.read_table(paths, columns=columns or COLUMNS, memory_map=True)
+    return table.to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the DPE csv shards to the parquet store.")
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--store-dir", default=STORE_DIR, type=Path)
+    parser.add_argument("--force", action="store_true", help="rebuild every part")
+    parser.add_argument("--content", action="store_true",
+                        help="fingerprint shards by content hash instead of mtime")
+    args = parser.parse_args()
+    manifest = build_store(args.data_dir, args.store_dir, force=args.force, content=args.content)
+    rows = sum(entry["rows"] for entry in manifest["parts"].values())
+    print(f"{len(manifest['parts'])} parts, {rows} rows in {args.store_dir}")
+
+
+if __name__ == "__main__":
+    main()
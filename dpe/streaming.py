@@ -0,0 +1,369 @@
+"""
+Streaming ingestion of the dpe-v2-logements-neufs shards.
+
+The shards are read in blocks of rows instead of whole, so memory follows
+the block size rather than the size of the dataset. The DPE without a
+valid date are dropped block by block and the other rows written as they
+are, with the 64-bit hash of their address and their date. The cleaning
+rules of ``dpe.cleaning.clean`` are then applied to all the shards at
+once from those keys alone: the rows that are not the most recent DPE of
+their address (the first one for the same date) are listed as duplicates
+and skipped when loading, and the aggregates of the duplicates are
+subtracted from the ones of all the rows. GHG outliers are flagged once
+the rows are loaded, as the bounds depend on all of them.
+
+Only the rows of the used columns and the additive aggregates of
+``dpe.aggregates`` are written, under ``<store>/stream``. The pages can
+then load them as they are (``DPE_INGEST=stream``).
+
+The store is refreshed incrementally. Every shard keeps its parts, the
+aggregates and keys of its rows, so that when the shards change:
+
+- unchanged shards are kept as they are,
+- rows appended at the end of a shard are ingested on their own,
+- modified and new shards are ingested again,
+
+and the duplicates are found again over the keys of every shard.
+
+Run ``python -m dpe.streaming`` to do the ingestion ahead of time.
+"""
+import argparse
+import hashlib
+import io
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+
+from dpe.aggregates import compute_aggregates, load_aggregates, merge_aggregates, save_aggregates
+from dpe.cleaning import ADDRESS, dates_as_int, drop_undated, flag_outliers, hash_addresses, latest_per_address, \
+    quality_report
+from dpe.config import DATA_DIR, STORE_DIR
+from dpe.schema import ARROW_TYPES, COLUMNS, DATE_COLUMN
+from dpe.store import convert_options, fingerprint, parse_dates, shard_paths
+
+# Bump when the layout of the stream store changes, to force a rebuild
+STREAM_VERSION = 4
+
+STREAM_NAME = "stream"
+MANIFEST_NAME = "manifest.json"
+AGGREGATES_NAME = "aggregates"
+# Aggregates of every row ingested, duplicates included
+INGESTED_NAME = "ingested"
+# Positions of the duplicates among the rows of all the parts
+DUPLICATES_NAME = "duplicates.npy"
+
+# Bytes of csv read at once
+BLOCK_SIZE = 16 << 20
+
+# Schema of the rows, fixed so that every block of a part matches
+ROW_SCHEMA = pa.schema([
+    (col, pa.timestamp("ns") if col == DATE_COLUMN else ARROW_TYPES[col]) for col in COLUMNS
+])
+
+
+def stream_dir(store_dir=STORE_DIR):
+    return Path(store_dir) / STREAM_NAME
+
+
+def read_blocks(source, block_size=BLOCK_SIZE):
+    """
+    Yield the rows of a csv shard (path or binary file) as frames of about
+    ``block_size`` bytes of csv, with the app schema.
+    """
+    read_options = pcsv.ReadOptions(block_size=block_size)
+    with pcsv.open_csv(source, read_options=read_options, convert_options=convert_options()) as reader:
+        for batch in reader:
+            yield parse_dates(pa.Table.from_batches([batch])).to_pandas()
+
+
+def ingest_blocks(blocks, part_path):
+    """
+    Write the dated rows of ``blocks`` to ``part_path``.
+
+    Return their aggregates, their number, the number of undated rows and
+    the address hashes and dates of the rows written.
+    """
+    aggregates = {}
+    rows = undated = 0
+    hashes, dates = [], []
+    tmp = part_path.with_suffix(".tmp")
+    with pq.ParquetWriter(tmp, ROW_SCHEMA, compression="zstd") as writer:
+        for block in blocks:
+            dated = drop_undated(block).reset_index(drop=True)
+            writer.write_table(pa.Table.from_pandas(dated, schema=ROW_SCHEMA, preserve_index=False))
+            aggregates = merge_aggregates(aggregates, compute_aggregates(dated))
+            hashes.append(hash_addresses(dated[ADDRESS]))
+            dates.append(dates_as_int(dated[DATE_COLUMN]))
+            rows += len(dated)
+            undated += len(block) - len(dated)
+    tmp.replace(part_path)
+    keys = (np.concatenate(hashes or [np.empty(0, dtype=np.uint64)]),
+            np.concatenate(dates or [np.empty(0, dtype=np.int64)]))
+    return aggregates, rows, undated, keys
+
+
+def read_stream_manifest(store_dir=STORE_DIR):
+    path = stream_dir(store_dir) / MANIFEST_NAME
+    if not path.exists():
+        return {"version": STREAM_VERSION, "shards": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != STREAM_VERSION:
+        return {"version": STREAM_VERSION, "shards": {}}
+    return manifest
+
+
+def write_stream_manifest(manifest, store_dir=STORE_DIR):
+    path = stream_dir(store_dir) / MANIFEST_NAME
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    tmp.replace(path)
+
+
+def _prefix_sha1(path, size):
+    # Hash of the first ``size`` bytes of a file
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while size > 0:
+            block = f.read(min(size, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            size -= len(block)
+    return digest.hexdigest()
+
+
+def _appended_rows(path, entry):
+    # Csv of the rows appended to a shard since ``entry`` was ingested, with
+    # its header line, or None if the shard was otherwise modified
+    size = path.stat().st_size
+    if size <= entry["size"] or _prefix_sha1(path, entry["size"]) != entry["sha1"]:
+        return None
+    with open(path, "rb") as f:
+        header = f.readline()
+        f.seek(entry["size"] - 1)
+        if f.read(1) != b"\n":
+            return None
+        return header + f.read()
+
+
+class _Shard:
+    # Files of a shard in the stream store
+
+    def __init__(self, directory, stem):
+        self.directory = directory
+        self.stem = stem
+        self.keys = directory / f"{stem}.keys.npz"
+        self.aggregates = directory / AGGREGATES_NAME / stem
+
+    def part(self, number):
+        return f"{self.stem}.parquet" if number == 0 else f"{self.stem}.{number}.parquet"
+
+    def load_keys(self):
+        with np.load(self.keys) as keys:
+            return keys["hashes"], keys["dates"]
+
+    def save_keys(self, hashes, dates):
+        np.savez(self.keys, hashes=hashes, dates=dates)
+
+    def remove(self, entry):
+        for part in entry["parts"]:
+            (self.directory / part).unlink(missing_ok=True)
+        self.keys.unlink(missing_ok=True)
+        shutil.rmtree(self.aggregates, ignore_errors=True)
+
+
+def _is_unchanged(path, entry):
+    # Same fingerprint, or touched with the same content
+    if fingerprint(path) == entry["fingerprint"]:
+        return True
+    return path.stat().st_size == entry["size"] and _prefix_sha1(path, entry["size"]) == entry["sha1"]
+
+
+def _source(path):
+    size = path.stat().st_size
+    return {"fingerprint": fingerprint(path), "size": size, "sha1": _prefix_sha1(path, size)}
+
+
+def _find_duplicates(directory, shards):
+    # Positions of the duplicates among the rows of the parts of ``shards``
+    # (in order) and their aggregates
+    keys = [_Shard(directory, Path(name).stem).load_keys() for name in shards]
+    hashes = np.concatenate([key[0] for key in keys] or [np.empty(0, dtype=np.uint64)])
+    dates = np.concatenate([key[1] for key in keys] or [np.empty(0, dtype=np.int64)])
+    duplicates = np.ones(len(hashes), dtype=bool)
+    duplicates[latest_per_address(hashes, dates)] = False
+    duplicates = np.flatnonzero(duplicates)
+
+    # Only the parts holding duplicates are read back
+    aggregates = {}
+    start = 0
+    for entry in shards.values():
+        for part, rows in zip(entry["parts"], entry["part_rows"]):
+            found = duplicates[(duplicates >= start) & (duplicates < start + rows)] - start
+            if len(found):
+                table = pq.read_table(directory / part, schema=ROW_SCHEMA).take(found)
+                aggregates = merge_aggregates(aggregates, compute_aggregates(table.to_pandas()))
+            start += rows
+    return duplicates, aggregates
+
+
+def refresh_stream(data_dir=DATA_DIR, store_dir=STORE_DIR, block_size=BLOCK_SIZE, force=False):
+    """
+    Bring the stream store up to date with the shards, ingesting only what
+    changed (everything if ``force``). Return the manifest and a report of
+    what was done.
+    """
+    directory = stream_dir(store_dir)
+    manifest = {"version": STREAM_VERSION, "shards": {}} if force else read_stream_manifest(store_dir)
+    if not manifest["shards"] and directory.exists():
+        # Nothing to keep (first run, forced or older layout)
+        shutil.rmtree(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    old = manifest["shards"]
+    paths = shard_paths(data_dir)
+    report = {"kept": [], "appended": [], "ingested": [], "removed": [], "rows": 0}
+    added, removed = [], []
+
+    shards = {}
+    for path in paths:
+        entry, shard = old.get(path.name), _Shard(directory, path.stem)
+        if entry is not None and _is_unchanged(path, entry):
+            shards[path.name] = {**entry, **_source(path)}
+            report["kept"].append(path.name)
+            continue
+        tail = None if entry is None else _appended_rows(path, entry)
+        if tail is not None:
+            # Only the rows appended to the shard are read
+            part = shard.part(len(entry["parts"]))
+            aggregates, rows, undated, (hashes, dates) = ingest_blocks(
+                read_blocks(io.BytesIO(tail), block_size), directory / part)
+            old_hashes, old_dates = shard.load_keys()
+            shard.save_keys(np.concatenate([old_hashes, hashes]), np.concatenate([old_dates, dates]))
+            save_aggregates(merge_aggregates(load_aggregates(shard.aggregates), aggregates), shard.aggregates)
+            shards[path.name] = {
+                **entry, **_source(path), "parts": entry["parts"] + [part],
+                "part_rows": entry["part_rows"] + [rows], "rows": entry["rows"] + rows,
+                "undated": entry["undated"] + undated,
+            }
+            report["appended"].append(path.name)
+        else:
+            if entry is not None:
+                # Modified: ingested again
+                removed.append(load_aggregates(shard.aggregates))
+                shard.remove(entry)
+            aggregates, rows, undated, (hashes, dates) = ingest_blocks(
+                read_blocks(path, block_size), directory / shard.part(0))
+            shard.save_keys(hashes, dates)
+            save_aggregates(aggregates, shard.aggregates)
+            shards[path.name] = {
+                **_source(path), "parts": [shard.part(0)], "part_rows": [rows], "rows": rows, "undated": undated,
+            }
+            report["ingested"].append(path.name)
+        added.append(aggregates)
+        report["rows"] += rows
+
+    for name, entry in old.items():
+        if name not in shards:
+            shard = _Shard(directory, Path(name).stem)
+            removed.append(load_aggregates(shard.aggregates))
+            shard.remove(entry)
+            report["removed"].append(name)
+
+    if not added and not removed and (directory / DUPLICATES_NAME).exists():
+        manifest = {**manifest, "shards": shards}
+        write_stream_manifest(manifest, store_dir)
+        return manifest, report
+
+    ingested = load_aggregates(directory / INGESTED_NAME) if old else {}
+    ingested = merge_aggregates(ingested, *removed, *added, sign=[1] + [-1] * len(removed) + [1] * len(added))
+    save_aggregates(ingested, directory / INGESTED_NAME)
+
+    # The most recent DPE of an address may now be in any shard
+    duplicates, duplicate_aggregates = _find_duplicates(directory, shards)
+    np.save(directory / DUPLICATES_NAME, duplicates)
+    save_aggregates(merge_aggregates(ingested, duplicate_aggregates, sign=[1, -1]), directory / AGGREGATES_NAME)
+    rows = sum(entry["rows"] for entry in shards.values())
+    manifest = {
+        "version": STREAM_VERSION, "shards": shards,
+        "addresses": rows - len(duplicates), "duplicates": len(duplicates),
+    }
+    write_stream_manifest(manifest, store_dir)
+    return manifest, report
+
+
+def is_stream_up_to_date(data_dir=DATA_DIR, store_dir=STORE_DIR):
+    manifest = read_stream_manifest(store_dir)
+    current = {path.name: fingerprint(path) for path in shard_paths(data_dir)}
+    known = {name: entry["fingerprint"] for name, entry in manifest["shards"].items()}
+    return bool(current) and current == known
+
+
+def stream_parts(data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Paths of the cleaned parts, refreshing the store first if the shards
+    changed.
+    """
+    if not is_stream_up_to_date(data_dir, store_dir):
+        refresh_stream(data_dir, store_dir)
+    manifest = read_stream_manifest(store_dir)
+    return [str(stream_dir(store_dir) / part) for entry in manifest["shards"].values() for part in entry["parts"]]
+
+
+def load_stream(columns=None, data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Load the cleaned rows (no further ``clean`` needed), refreshing the
+    store first if the shards changed. The whole rows are flagged and come
+    with the quality report of the cleaning in ``attrs["quality"]``.
+    """
+    paths = stream_parts(data_dir, store_dir)
+    if not paths:
+        return pd.DataFrame(columns=columns or COLUMNS)
+    table = pq.read_table(paths, columns=columns or COLUMNS, schema=ROW_SCHEMA, memory_map=True)
+    duplicates = np.load(stream_dir(store_dir) / DUPLICATES_NAME)
+    kept = np.ones(len(table), dtype=bool)
+    kept[duplicates] = False
+    dpe_data = table.filter(pa.array(kept)).to_pandas()
+    if columns is not None:
+        return dpe_data
+    dpe_data, bounds = flag_outliers(dpe_data)
+    shards = read_stream_manifest(store_dir)["shards"].values()
+    rows_in = sum(entry["rows"] + entry["undated"] for entry in shards)
+    dpe_data.attrs["quality"] = quality_report(rows_in, sum(entry["undated"] for entry in shards),
+                                               len(duplicates), dpe_data, bounds)
+    return dpe_data
+
+
+def load_stream_aggregates(data_dir=DATA_DIR, store_dir=STORE_DIR):
+    """
+    Load the aggregates of the cleaned rows.
+    """
+    stream_parts(data_dir, store_dir)
+    return load_aggregates(stream_dir(store_dir) / AGGREGATES_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest the DPE csv shards block by block.")
+    parser.add_argument("--data-dir", default=DATA_DIR, type=Path)
+    parser.add_argument("--store-dir", default=STORE_DIR, type=Path)
+    parser.add_argument("--block-size", default=BLOCK_SIZE, type=int, help="bytes of csv read at once")
+    parser.add_argument("--force", action="store_true", help="ingest every shard again")
+    args = parser.parse_args()
+    manifest, report = refresh_stream(args.data_dir, args.store_dir, args.block_size, force=args.force)
+    rows = sum(entry["rows"] for entry in manifest["shards"].values())
+    print(f"kept {len(report['kept'])}, appended to {len(report['appended'])}, "
+          f"ingested {len(report['ingested'])}, removed {len(report['removed'])} shards "
+          f"({report['rows']} new rows)")
+    print(f"{len(manifest['shards'])} shards, {rows} dated rows, {manifest['addresses']} addresses "
+          f"in {stream_dir(args.store_dir)}")
+
+
+if __name__ == "__main__":
+    main()
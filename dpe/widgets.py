@@ -0,0 +1,71 @@
+"""
+Widgets shared by several pages.
+
+The filters of the sidebar keep their selection in ``st.session_state``
+under ``FILTERS_KEY``, so that it follows the user from the Geographical
+overview to the drill-down page and back.
+"""
+import streamlit as st
+
+FILTERS_KEY = "geo_filters"
+
+
+def _restore(key, default, valid):
+    # Value of the widget ``key``: the saved selection if still valid, else
+    # ``default``. Streamlit drops the state of the widgets of the previous
+    # page, so it is set again before every rendering.
+    saved = st.session_state.setdefault(FILTERS_KEY, {}).get(key)
+    st.session_state[key] = saved if saved is not None and valid(saved) else default
+
+
+def _save(key):
+    # Called on a change, before the rerun: keep the new selection
+    st.session_state[FILTERS_KEY][key] = st.session_state[key]
+
+
+def sidebar_filters(filter_options):
+    """
+    Year range, building types and DPE categories chosen in the sidebar,
+    from the ``filter_options`` of a backend.
+    """
+    st.sidebar.header("📇 ​Filters")
+
+    # Year Slider
+    min_year, max_year = filter_options["min_year"], filter_options["max_year"]
+    _restore("filter_years", (min_year, max_year),
+             lambda years: min_year <= years[0] <= years[1] <= max_year)
+    year_range = st.sidebar.slider(
+        "Select a Year Range",
+        min_value=min_year,
+        max_value=max_year,
+        step=1,
+        key="filter_years",
+        on_change=_save,
+        args=("filter_years",),
+    )
+
+    # Building Type Filter (multi-select), all selected by default
+    all_building_types = filter_options["building_types"]
+    _restore("filter_building_types", all_building_types,
+             lambda selected: set(selected) <= set(all_building_types))
+    selected_building_types = st.sidebar.multiselect(
+        "Building Type",
+        options=all_building_types,
+        key="filter_building_types",
+        on_change=_save,
+        args=("filter_building_types",),
+    )
+
+    # DPE Category Filter (multi-select)
+    all_categories = filter_options["categories"]
+    _restore("filter_categories", all_categories,
+             lambda selected: set(selected) <= set(all_categories))
+    selected_categories = st.sidebar.multiselect(
+        "DPE Category (A, B, C, ...)",
+        options=all_categories,
+        key="filter_categories",
+        on_change=_save,
+        args=("filter_categories",),
+    )
+
+    return tuple(year_range), selected_building_types, selected_categories
@@ -1,13 +1,18 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-import numpy as np
 
-from General_Presentation import load_data
+from dpe.dataset import load_backend
+from dpe.debug import debug_panel, start_page, track_chart
+from dpe.instrument import stage
+from dpe.reduction import enable_server_transforms
 
-# Load data
-dpe_data = load_data()
-dpe_data.drop_duplicates(subset='Adresse_(BAN)', inplace=True)
+st.set_page_config(layout="wide")
+start_page("Breakown_per_Departement_and_Adress")
+enable_server_transforms()
+
+# Queries on the shared, already deduplicated data (see dpe/backends.py)
+backend = load_backend()
 
 #---------------------------------------------------------------------------------------
 # --------------------   AVERAGE DPE AND GES BY DEPARTEMENT --------------------------
@@ -15,17 +20,28 @@ dpe_data.drop_duplicates(subset='Adresse_(BAN)', inplace=True)
 
 st.subheader("📮​ Breakdown by Departement of Average DPE and GES", help="Compared to the average of number of DPE and GES Etiquettes per Departement")
 
-departement = st.selectbox("Choose a Departement", options=dpe_data["N°_département_(BAN)"].unique().tolist())
+# Label counts per departement, computed once (see dpe/cubes.py)
+with stage("label_table") as record:
+    label_table = backend.label_table()
+    record["rows_out"] = len(label_table)
 
-dpeb = {
-    "Etiquette":["A", "B", "C", "D", "E", "F", "G"],
-    "Etiquette_DPE":[0, 0, 0, 0, 0, 0, 0],
-    "Etiquette_GES":[0, 0, 0, 0, 0, 0, 0],
-}
-dpe_m = pd.DataFrame(dpeb)
-for i, et in enumerate(dpe_m["Etiquette"]):
-    dpe_m.at[i,"Etiquette_DPE"] = len(dpe_data[dpe_data["Etiquette_DPE"]==et])/len(dpe_data["N°_département_(BAN)"].unique())
-    dpe_m.at[i,"Etiquette_GES"] = len(dpe_data[dpe_data["Etiquette_GES"]==et])/len(dpe_data["N°_département_(BAN)"].unique())
+departement = st.selectbox("Choose a Departement", options=label_table.index.tolist())
+
+# Cumulative label counts per departement by month, computed once: the
+# counts of any range of months are two lookups per label (see dpe/label_timeline.py)
+with stage("label_timeline") as record:
+    timeline = backend.label_timeline()
+    record["rows_out"] = len(timeline.months)
+
+first_month, last_month = st.select_slider(
+    "DPE issued between",
+    options=timeline.months.tolist(),
+    value=timeline.month_range(),
+    format_func=lambda month: month.strftime("%b %Y"),
+)
+
+# National average per departement
+dpe_m = timeline.average(first_month, last_month)
 
 dpe_m_melted = dpe_m.melt(
     id_vars='Etiquette',
@@ -53,10 +69,8 @@ basem = alt.Chart(dpe_m_melted).mark_bar(color="lightgrey").encode(
     title="Average DPE and GES by Departement"
 )
 
-dpeb_p = pd.DataFrame(dpeb)
-for i, et in enumerate(dpeb_p["Etiquette"]):
-    dpeb_p.at[i,"Etiquette_DPE"] = len(dpe_data[(dpe_data["N°_département_(BAN)"]==departement) & (dpe_data["Etiquette_DPE"]==et)])
-    dpeb_p.at[i,"Etiquette_GES"] = len(dpe_data[(dpe_data["N°_département_(BAN)"]==departement) & (dpe_data["Etiquette_GES"]==et)])
+# Counts of the selected departement
+dpeb_p = timeline.counts(first_month, last_month, departement)
 
 dpeb_p_melted = dpeb_p.melt(
     id_vars='Etiquette',
@@ -82,7 +96,7 @@ chart3 = alt.Chart(dpeb_p_melted).mark_bar(clip=True, opacity=0.6).encode(
 
 combined = basem + chart3
 
-st.altair_chart(combined, use_container_width=True)
+st.altair_chart(track_chart("labels", combined), use_container_width=True)
 
 #---------------------------------------------------------------------------------------
 # --------------------   BREAKDOWN PER ADRESS ----------------------------------------
@@ -90,14 +104,25 @@ st.altair_chart(combined, use_container_width=True)
 
 st.subheader("​📫​ Breakdown per Adress")
 
-adress = st.selectbox("Choose an Adress", options=dpe_data['Adresse_(BAN)'].unique().tolist())
+# Only a bounded list of matches is sent to the selectbox (see dpe/address_index.py)
+search = st.text_input("Search an Adress", placeholder="Street, number or city")
+with stage("search_addresses") as record:
+    matches = backend.search_addresses(search, limit=50)
+    record["rows_out"] = len(matches)
+if not matches:
+    st.warning("No adress found, try another spelling.")
+    debug_panel()
+    st.stop()
+adress = st.selectbox("Choose an Adress", options=matches)
 
 col1, col2 = st.columns([2, 2])
 
 # Adress cart
 col1.subheader('Adress Cart')
 
-row = dpe_data[dpe_data['Adresse_(BAN)']==adress]
+with stage("address_row") as record:
+    row = backend.address_row(adress)
+    record["rows_out"] = len(row)
 
 markdown_text = f"""
 **Adresse** : {adress}
@@ -120,12 +145,13 @@ col1.markdown(markdown_text)
 # Show statistics and compare 
 col2.subheader("Energy Consumption & Cost", help=f"Compared with batiments with:\n\n Type of Batiment: {row['Type_bâtiment'].iloc[0]}\n\n GES Category: {row['Etiquette_GES'].iloc[0]}\n\n DPE Category: {row['Etiquette_DPE'].iloc[0]}")
 
-query_txt = f"Type_bâtiment =='{row['Type_bâtiment'].iloc[0]}' and Etiquette_GES=='{row['Etiquette_GES'].iloc[0]}' and Etiquette_DPE=='{row['Etiquette_DPE'].iloc[0]}'"
-query = dpe_data.query(query_txt)
+# Means of the peer group, precomputed for every group (see dpe/cubes.py)
+with stage("peer_means"):
+    query = backend.peer_means(row['Type_bâtiment'].iloc[0], row['Etiquette_GES'].iloc[0], row['Etiquette_DPE'].iloc[0])
 dfb = {
     "type":["Heating", "Lighting", "ECS", "Cooling"],
-    "cost":[np.mean(query["Coût_chauffage"]), np.mean(query["Coût_éclairage"]), np.mean(query["Coût_ECS"]), np.mean(query["Coût_refroidissement"])],
-    "conso":[np.mean(query["Conso_chauffage_é_finale"]), np.mean(query["Conso_éclairage_é_finale"]), np.mean(query["Conso_ECS_é_finale"]), np.mean(query["Conso_refroidissement_é_finale"])]
+    "cost":[query["Coût_chauffage"], query["Coût_éclairage"], query["Coût_ECS"], query["Coût_refroidissement"]],
+    "conso":[query["Conso_chauffage_é_finale"], query["Conso_éclairage_é_finale"], query["Conso_ECS_é_finale"], query["Conso_refroidissement_é_finale"]]
 }
 dfb = pd.DataFrame(dfb)
 
@@ -156,5 +182,6 @@ bars = alt.Chart(df).mark_bar().encode(
     tooltip=["type", "conso", "cost"],
 ).add_selection(selection)
 
-col2.altair_chart(base+bars, theme=None, use_container_width=True)
+col2.altair_chart(track_chart("address", base+bars), theme=None, use_container_width=True)
 
+debug_panel()
@@ -0,0 +1,72 @@
+import pandas as pd
+import streamlit as st
+
+from dpe.dataset import load_backend
+from dpe.debug import debug_panel, start_page
+from dpe.instrument import stage
+from dpe.schema import COLUMNS, DATE_COLUMN, GHG_OUTLIER
+from dpe.widgets import sidebar_filters
+
+st.set_page_config(layout="wide")
+start_page("Drill_down")
+
+# The rows are served one page at a time by the backend, from an index by
+# (departement, DPE label, date) (see dpe/row_index.py): only the visible
+# window is read and sent to the browser
+backend = load_backend()
+
+# 1. Filters of the Geographical overview, kept when switching pages
+year_range, selected_building_types, selected_categories = sidebar_filters(backend.filter_options())
+
+# The rows without a département are listed last, as one more option
+all_departements = backend.label_table().index.tolist()
+selected_departements = st.sidebar.multiselect(
+    "Département (all if empty)",
+    options=all_departements,
+    format_func=lambda departement: "Unknown" if pd.isna(departement) else departement,
+)
+
+# 2. Columns, sort and page size of the table
+st.subheader("🔎 Drill-down: DPE per Département and Label")
+col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+with col1:
+    shown_columns = st.multiselect("Columns", options=COLUMNS + [GHG_OUTLIER], default=COLUMNS[:4] + [DATE_COLUMN])
+with col2:
+    sort_by = st.selectbox("Sort by", options=["Département, label and date"] + COLUMNS)
+with col3:
+    # The default order (by département, label and date) has no direction
+    ascending = st.toggle("Ascending", value=True, disabled=sort_by not in COLUMNS)
+with col4:
+    page_size = st.selectbox("Rows per page", options=[25, 50, 100, 250], index=1)
+
+if not shown_columns:
+    st.info("Choose at least one column to show.")
+    debug_panel()
+    st.stop()
+
+# 3. Only the rows of the current page are fetched
+page = st.number_input("Page", min_value=1, value=1, step=1)
+query = dict(
+    year_range=year_range,
+    building_types=selected_building_types,
+    categories=selected_categories,
+    departements=selected_departements or None,
+    sort_by=None if sort_by not in COLUMNS else sort_by,
+    ascending=ascending,
+    columns=shown_columns,
+    page_size=page_size,
+)
+with stage("rows_page") as record:
+    rows, total = backend.rows_page(page=page - 1, **query)
+    pages = max((total + page_size - 1) // page_size, 1)
+    if page > pages:
+        # Past the last page (the filters changed): show the last one
+        page = pages
+        rows, total = backend.rows_page(page=page - 1, **query)
+    record["rows_out"] = len(rows)
+
+first = (page - 1) * page_size
+st.dataframe(rows, hide_index=True, use_container_width=True)
+st.caption(f"Rows {min(first + 1, total):,} to {first + len(rows):,} of {total:,}, page {page} of {pages}")
+
+debug_panel()
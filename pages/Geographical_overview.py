@@ -1,127 +1,66 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import altair as alt
-import json
-import numpy as np
-import matplotlib.pyplot as plt
-
-from General_Presentation import load_data
-
-# Load data
-dpe_data = load_data()
-dpe_data.drop_duplicates(subset='Adresse_(BAN)', inplace=True)
-
-
-# 3. Add UI for Filters
-st.sidebar.header("📇 ​Filters")
-
-# 3a. Year Slider
-#    Get the min and max years from your DPE date
-valid_years = dpe_data["Date_établissement_DPE"].dropna().dt.year
-min_year, max_year = int(valid_years.min()), int(valid_years.max())
-year_range = st.sidebar.slider(
-    "Select a Year Range",
-    min_value=min_year,
-    max_value=max_year,
-    value=(min_year, max_year),
-    step=1
-)
-
-# 3b. Building Type Filter (multi-select)
-all_building_types = dpe_data["Type_bâtiment"].dropna().unique().tolist()
-selected_building_types = st.sidebar.multiselect(
-    "Building Type",
-    options=all_building_types,
-    default=all_building_types  # By default, select all
-)
-
-# 3c. DPE Category Filter (multi-select)
-all_categories = dpe_data["Etiquette_DPE"].dropna().unique().tolist()
-selected_categories = st.sidebar.multiselect(
-    "DPE Category (A, B, C, ...)",
-    options=all_categories,
-    default=all_categories
-)
-
-# 4. Filter the data based on UI selections
-filtered_data = dpe_data.copy()
-
-# 4a. Filter by year range
-filtered_data = filtered_data[
-    (filtered_data["Date_établissement_DPE"].dt.year >= year_range[0]) &
-    (filtered_data["Date_établissement_DPE"].dt.year <= year_range[1])
-]
-
-# 4b. Filter by building types
-filtered_data = filtered_data[
-    filtered_data["Type_bâtiment"].isin(selected_building_types)
-]
-
-# 4c. Filter by DPE categories
-filtered_data_map = filtered_data[
-    filtered_data["Etiquette_DPE"].isin(selected_categories).copy()
-]
-
-# 5. Group by department to compute metrics for the map
-#    Adjust column names as needed. This example calculates:
+
+from dpe.dataset import get_backend, get_departements_geojson, load_backend
+from dpe.debug import debug_panel, start_page, track_chart
+from dpe.geo import tolerance_for_zoom
+from dpe.instrument import stage
+from dpe.reduction import enable_server_transforms
+from dpe.sections import Sections
+from dpe.widgets import sidebar_filters
+
+st.set_page_config(layout="wide")
+start_page("Geographical_overview")
+enable_server_transforms()
+
+# Every metric below is answered by the backend from counts and sums per
+# (year, building type, DPE category, departement) (see dpe/cubes.py)
+#
+# 4/5. Metrics for the map per department, summed over the cube cells
+#    matching the filters:
 #    - total_new: count of N°DPE
 #    - efg_count: how many are E/F/G
 #    - efg_percent: efg_count / total_new
 #    - ghg_m2_avg: mean of Emission_GES_5_usages_par_m²
-#    - conso_m2_avg: mean of Conso_5_usages_é_finale_par_m² (if available)
-if (
-    "N°_département_(BAN)" in filtered_data_map.columns and
-    "Emission_GES_5_usages_par_m²" in filtered_data_map.columns and
-    "N°DPE" in filtered_data_map.columns
-):
-    dept_summary = (
-        filtered_data_map
-        .groupby("N°_département_(BAN)")
-        .agg(
-            total_new=("N°DPE", "count"),
-            efg_count=("Etiquette_DPE", lambda x: x.isin(["E", "F", "G"]).sum()),
-            ghg_m2_avg=("Emission_GES_5_usages_par_m²", "mean")
-            # If you have a column for total consumption per m², uncomment the line below:
-            # conso_m2_avg=("Conso_5_usages_é_finale_par_m²", "mean")
-        )
-        .reset_index()
-        .rename(columns={"N°_département_(BAN)": "departement"})
-    )
+#    The map and the E/F/G chart are computed concurrently in the background
+#    (see dpe/sections.py) while the text of the page is shown
+MAP_ZOOM = 5
+
 
-    # efg percentage
-    dept_summary["efg_percent"] = dept_summary["efg_count"] / dept_summary["total_new"]
+def map_figure():
+    backend = get_backend()
+    with stage("departement_summary") as record:
+        dept_summary = backend.departement_summary(year_range, selected_building_types, selected_categories)
+        record["rows_out"] = len(dept_summary)
 
     # Convert department codes to string, zero-pad if needed
-    dept_summary["departement"] = dept_summary["departement"].astype(str).str.zfill(2)
-else:
-    st.write("Error: Required columns not found for department grouping.")
-    dept_summary = pd.DataFrame(columns=["departement", "ghg_m2_avg"])
-
-# 6. Load GeoJSON
-try:
-    with open("data/departements.geojson", "r", encoding="utf-8") as f:
-        france_geojson = json.load(f)
-except FileNotFoundError:
-    st.error("GeoJSON file for French departments not found.")
-    france_geojson = None
+    dept_summary["departement"] = dept_summary["departement"].str.zfill(2)
+
+    # 6. Load GeoJSON, simplified to what is visible at the zoom of the whole
+    #    country (see dpe/geo.py) and parsed once per process
+    try:
+        france_geojson = get_departements_geojson(tolerance_for_zoom(MAP_ZOOM))
+    except FileNotFoundError:
+        return "GeoJSON file for French departments not found."
+
+    if dept_summary.empty:
+        return None
 
-# 7. Create the Map
-st.subheader("🌍 Geographic Overview: Departmental Metrics")
-st.markdown(f"""
-*Current filters for this map*:
-- **Year Range**: {year_range[0]} to {year_range[1]}  
-- **Building Types**: {', '.join(selected_building_types)}  
-- **DPE Category**: {', '.join(selected_categories)}  
-""")
-if not dept_summary.empty and france_geojson is not None:
     # Round GHG to 2 decimals in hover
     dept_summary["ghg_m2_avg"] = dept_summary["ghg_m2_avg"].round(2)
     # If you have conso_m2_avg, also round it: dept_summary["conso_m2_avg"] = dept_summary["conso_m2_avg"].round(2)
 
+    # Only send the shapes of the departements on the map
+    shown = set(dept_summary["departement"])
+    map_geojson = {
+        "type": "FeatureCollection",
+        "features": [f for f in france_geojson["features"] if f["properties"]["code"] in shown],
+    }
+
     fig = px.choropleth(
         dept_summary,
-        geojson=france_geojson,
+        geojson=map_geojson,
         locations="departement",
         color="ghg_m2_avg",  # color by average GHG
         color_continuous_scale='Reds',
@@ -169,45 +108,28 @@ if not dept_summary.empty and france_geojson is not None:
             
         )
     )
+    return fig
 
-    st.plotly_chart(fig, use_container_width=True)
-else:
-    st.write("No map data to display. Check filters or missing columns.")
 
+def show_map(fig):
+    if isinstance(fig, str):
+        st.error(fig)
+    elif fig is not None:
+        st.plotly_chart(track_chart("map", fig), use_container_width=True)
+    else:
+        st.write("No map data to display. Check filters or missing columns.")
 
-# -----------------------------------------------------------------------------
-# --------------------  INEFFICIENT BUILDINGS (E/F/G) ------------------------
-# -----------------------------------------------------------------------------
 
-# FOCUS ON INEFFICIENT BUILDINGS (E, F, G) - BY DEPARTMENT
+def inefficient_chart():
+    # Year + building type filters only
+    # Count and average GHG per m² per department & DPE category (E/F/G)
+    backend = get_backend()
+    with stage("inefficient_breakdown") as record:
+        ineff_dept = backend.inefficient_breakdown(year_range, selected_building_types)
+        record["rows_out"] = len(ineff_dept)
 
-st.subheader("🔬​ Focus on Inefficient Buildings (E, F, G) - Detailed Department View")
-st.markdown(f"""
-*Current filters for this map*:
-- **Year Range**: {year_range[0]} to {year_range[1]}  
-- **Building Types**: {', '.join(selected_building_types)}  
-- *DPE Category is ignored here so we always see a complete departmental overview.*
-""")
-# Re-use filtered_data_map (year + building type only)
-inefficient_data = filtered_data[filtered_data["Etiquette_DPE"].isin(["E", "F", "G"])]
-
-if not inefficient_data.empty:
-    # Group by department & DPE category to compute:
-    # - building_count: how many E/F/G buildings in each dept
-    # - avg_GHG: average GHG per m² for these buildings
-    # - avg_conso: average consumption per m² (if you have such a column)
-    #   Adjust column names as needed:
-    ineff_dept = (
-        inefficient_data
-        .groupby(["N°_département_(BAN)", "Etiquette_DPE"])
-        .agg(
-            building_count=("N°DPE", "count"),
-            avg_GHG=("Emission_GES_5_usages_par_m²", "mean"),
-            # If you have a per-m² consumption column, uncomment:
-            # avg_conso=("Conso_5_usages_é_finale_par_m²", "mean")
-        )
-        .reset_index()
-    )
+    if ineff_dept.empty:
+        return None
 
     # Convert department to string, zero-pad if needed
     ineff_dept["N°_département_(BAN)"] = (
@@ -217,7 +139,7 @@ if not inefficient_data.empty:
     )
     # Create a stacked bar chart in Altair
     brush_dep = alt.selection(type='interval', encodings=['x'])
-    chart = (
+    return (
         alt.Chart(ineff_dept)
         .mark_bar()
         .encode(
@@ -238,7 +160,13 @@ if not inefficient_data.empty:
         .add_selection(brush_dep)
     )
 
-    st.altair_chart(chart, use_container_width=True)
+
+def show_inefficient(chart):
+    if chart is None:
+        st.write("No inefficient buildings (E/F/G) found with the current filters.")
+        return
+
+    st.altair_chart(track_chart("inefficient_breakdown", chart), use_container_width=True)
 
     st.markdown("""
     *This stacked bar chart shows how many inefficient buildings (E, F, G) exist in each 
@@ -246,6 +174,50 @@ if not inefficient_data.empty:
     the average GHG per m² and other metrics. DPE category filtering is intentionally 
     ignored here so we can always see E/F/G data.*
     """)
-else:
-    st.write("No inefficient buildings (E/F/G) found with the current filters.")
 
+
+sections = Sections()
+
+# 7. Create the Map
+st.subheader("🌍 Geographic Overview: Departmental Metrics")
+map_filters = st.empty()
+map_placeholder = sections.reserve("Loading the map...")
+
+
+# -----------------------------------------------------------------------------
+# --------------------  INEFFICIENT BUILDINGS (E/F/G) ------------------------
+# -----------------------------------------------------------------------------
+
+# FOCUS ON INEFFICIENT BUILDINGS (E, F, G) - BY DEPARTMENT
+
+st.subheader("🔬​ Focus on Inefficient Buildings (E, F, G) - Detailed Department View")
+inefficient_filters = st.empty()
+inefficient_placeholder = sections.reserve("Loading the E/F/G chart...")
+
+
+# 3. Add UI for Filters, shared with the drill-down page (see dpe/widgets.py)
+#    from the bounds and options computed once by the backend, loaded while
+#    the headers and placeholders above are shown
+with st.sidebar:
+    filter_options = load_backend().filter_options()
+year_range, selected_building_types, selected_categories = sidebar_filters(filter_options)
+
+map_filters.markdown(f"""
+*Current filters for this map*:
+- **Year Range**: {year_range[0]} to {year_range[1]}  
+- **Building Types**: {', '.join(selected_building_types)}  
+- **DPE Category**: {', '.join(selected_categories)}  
+""")
+sections.add("map", map_figure, show_map, placeholder=map_placeholder)
+
+inefficient_filters.markdown(f"""
+*Current filters for this map*:
+- **Year Range**: {year_range[0]} to {year_range[1]}  
+- **Building Types**: {', '.join(selected_building_types)}  
+- *DPE Category is ignored here so we always see a complete departmental overview.*
+""")
+sections.add("inefficient_breakdown", inefficient_chart, show_inefficient, placeholder=inefficient_placeholder)
+
+sections.render()
+
+debug_panel()